@@ -26,7 +26,13 @@ setuptools.setup(
     python_requires='>=3.7',
     packages=setuptools.find_packages(),
     include_package_data=True,
-    install_requires=['loguru', 'aiohttp', 'aiofiles', 'cchardet', 'aiodns', 'click'],
+    install_requires=['loguru', 'aiohttp', 'cchardet', 'aiodns', 'click'],
+    extras_require={
+        'speedups': [
+            'orjson',
+            'uvloop; sys_platform != "win32"',
+        ]
+    },
     entry_points='''
         [console_scripts]
         vscod=vscod.scripts.vscod:cli
@@ -0,0 +1,75 @@
+import asyncio
+import sys
+import types
+import unittest
+from unittest import mock
+
+from click.testing import CliRunner
+
+from vscod.scripts import vscod
+
+
+async def _get_loop() -> asyncio.AbstractEventLoop:
+    return asyncio.get_running_loop()
+
+
+class RunTest(unittest.TestCase):
+    def test_default_loop_without_uvloop(self) -> None:
+        with mock.patch.object(vscod, 'uvloop', None):
+            self.assertIsInstance(vscod._run(_get_loop()), asyncio.AbstractEventLoop)
+
+    def test_uvloop_run(self) -> None:
+        fake_uvloop = types.SimpleNamespace(run=mock.Mock(return_value='done'))
+        main = _get_loop()
+        with mock.patch.object(vscod, 'uvloop', fake_uvloop):
+            self.assertEqual(vscod._run(main), 'done')
+        fake_uvloop.run.assert_called_once_with(main)
+        main.close()
+
+    @unittest.skipIf(sys.version_info < (3, 11), 'asyncio.Runner is new in Python 3.11')
+    def test_uvloop_loop_factory(self) -> None:
+        loops = []
+
+        def new_event_loop() -> asyncio.AbstractEventLoop:
+            loops.append(asyncio.new_event_loop())
+            return loops[-1]
+
+        fake_uvloop = types.SimpleNamespace(new_event_loop=new_event_loop)
+        policy = asyncio.get_event_loop_policy()
+        with mock.patch.object(vscod, 'uvloop', fake_uvloop):
+            self.assertIs(vscod._run(_get_loop()), loops[0])
+        self.assertIs(asyncio.get_event_loop_policy(), policy)  # The global policy is left alone.
+
+
+class ConcurrencyOptionTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.runner = CliRunner()
+        patcher = mock.patch.multiple(
+            vscod, configure_verbosity=mock.DEFAULT, configure_concurrency=mock.DEFAULT
+        )
+        self.configured = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_limit_is_configured(self) -> None:
+        for args in (['-j', '4'], ['--concurrency', '4']):
+            self.configured['configure_concurrency'].reset_mock()
+            result = self.runner.invoke(vscod.cli, [*args, 'list-opts'])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.configured['configure_concurrency'].assert_called_once_with(4)
+
+    def test_default_limit(self) -> None:
+        result = self.runner.invoke(vscod.cli, ['list-opts'])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.configured['configure_concurrency'].assert_called_once_with(vscod.CONCURRENCY_LIMIT)
+        result = self.runner.invoke(vscod.cli, ['--help'])
+        self.assertIn(f'default: {vscod.CONCURRENCY_LIMIT}', result.output)
+
+    def test_invalid_limit_is_rejected(self) -> None:
+        for value in ('0', 'many'):
+            result = self.runner.invoke(vscod.cli, ['-j', value, 'list-opts'])
+            self.assertEqual(result.exit_code, 2, result.output)
+        self.configured['configure_concurrency'].assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,212 @@
+import asyncio
+import email.utils
+import os
+import tempfile
+import typing
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from aiohttp import web
+
+from vscod import utils
+from vscod.cache import DownloadManifest
+
+PAYLOAD = os.urandom(3 * 1024 * 1024 + 123)  # Spans several write blocks.
+FILENAME = 'payload.bin'
+DROP_AFTER = 2 * 1024 * 1024 + 512 * 1024  # Bytes sent before the `/drop` route cuts the body.
+
+
+class _Server:
+    """
+    A local server serving `PAYLOAD` the way the marketplace and update servers do (`ETag`,
+    `Last-Modified`, conditional and range requests), recording the headers of every request.
+    `/drop` and `/drop-unvalidated` cut their first response short, the latter without sending
+    any validator to resume it with.
+    """
+
+    def __init__(self, payload_path: Path) -> None:
+        self.payload_path = payload_path
+        self.requests: typing.List[typing.Dict[str, str]] = []
+        self.statuses: typing.List[int] = []
+        self._dropped = False
+        self._runner: typing.Optional[web.AppRunner] = None
+        self.base_url = ''
+
+    async def _handle(self, request: web.Request) -> web.StreamResponse:
+        self.requests.append(dict(request.headers))
+        if request.path.startswith('/drop') and not self._dropped:
+            self._dropped = True
+            headers = {'Content-Length': str(len(PAYLOAD))}
+            if request.path == '/drop':
+                mtime = self.payload_path.stat().st_mtime
+                headers['Last-Modified'] = email.utils.formatdate(mtime, usegmt=True)
+            response = web.StreamResponse(headers=headers)
+            await response.prepare(request)
+            await response.write(PAYLOAD[:DROP_AFTER])
+            request.transport.close()
+            return response
+        response = web.FileResponse(self.payload_path)
+        response.headers['Content-Disposition'] = f'attachment; filename="{FILENAME}"'
+        return response
+
+    async def _record_status(self, request: web.Request, response: web.StreamResponse) -> None:
+        self.statuses.append(response.status)
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get('/{name}', self._handle)
+        app.on_response_prepare.append(self._record_status)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        self.base_url = f'http://127.0.0.1:{port}'
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+
+
+class DownloadUrlTest(unittest.TestCase):
+    def setUp(self) -> None:
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.root = Path(temp_dir.name)
+        self.payload_path = self.root / 'served.bin'
+        self.payload_path.write_bytes(PAYLOAD)
+        # Whole seconds, so `Last-Modified` dates match the file exactly when comparing `If-Range`.
+        os.utime(self.payload_path, (1600000000, 1600000000))
+        self.output = self.root / 'output'
+        self.output.mkdir()
+        # Retry right away instead of backing off.
+        patcher = mock.patch.multiple(
+            utils, RETRY_MAX_DELAY=0, random=mock.Mock(random=mock.Mock(return_value=0.0))
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _run(self, test: typing.Callable[[_Server], typing.Awaitable[None]]) -> None:
+        async def _run_with_server() -> None:
+            server = _Server(self.payload_path)
+            await server.start()
+            try:
+                await test(server)
+            finally:
+                await server.stop()
+
+        asyncio.run(_run_with_server())
+
+    def _assert_downloaded(self, path: Path) -> None:
+        self.assertEqual(path, self.output / FILENAME)
+        self.assertEqual(path.read_bytes(), PAYLOAD)
+        self.assertEqual([p.name for p in self.output.glob('*.part')], [])
+        self.assertEqual([p.name for p in self.output.glob('.*.part')], [])
+
+    def test_fresh_download_is_named_from_response(self) -> None:
+        async def test(server: _Server) -> None:
+            async with utils.create_session() as session:
+                path = await utils.download_url(session, f'{server.base_url}/a', str(self.output))
+            self._assert_downloaded(path)
+            self.assertEqual(server.requests[0]['Accept-Encoding'], 'identity')
+            self.assertNotIn('Range', server.requests[0])
+
+        self._run(test)
+
+    def test_unchanged_download_is_skipped(self) -> None:
+        async def test(server: _Server) -> None:
+            url = f'{server.base_url}/a'
+            async with utils.create_session() as session:
+                for _ in range(2):
+                    manifest = DownloadManifest(self.output)
+                    path = await utils.download_url(session, url, self.output, manifest=manifest)
+                    manifest.save()
+            self._assert_downloaded(path)
+            self.assertNotIn('If-None-Match', server.requests[0])
+            self.assertIn('If-None-Match', server.requests[1])
+            self.assertEqual(server.statuses, [200, 304])
+
+        self._run(test)
+
+    def test_same_url_in_two_directories_is_skipped_for_both(self) -> None:
+        async def test(server: _Server) -> None:
+            url = f'{server.base_url}/a'
+            directories = [self.output / 'first', self.output / 'second']
+            for directory in directories:
+                directory.mkdir()
+            async with utils.create_session() as session:
+                for _ in range(2):
+                    manifest = DownloadManifest(self.output)
+                    await asyncio.gather(
+                        *[
+                            utils.download_url(session, url, directory, manifest=manifest)
+                            for directory in directories
+                        ]
+                    )
+                    manifest.save()
+            self.assertEqual(server.statuses, [200, 200, 304, 304])
+
+        self._run(test)
+
+    def test_dropped_download_is_resumed(self) -> None:
+        async def test(server: _Server) -> None:
+            async with utils.create_session() as session:
+                path = await utils.download_url(session, f'{server.base_url}/drop', self.output)
+            self._assert_downloaded(path)
+            self.assertEqual(len(server.requests), 2)
+            self.assertRegex(server.requests[1]['Range'], r'^bytes=[1-9]\d*-$')
+            self.assertIn('If-Range', server.requests[1])
+            self.assertEqual(server.statuses[1], 206)
+
+        self._run(test)
+
+    def test_dropped_download_without_validators_starts_over(self) -> None:
+        async def test(server: _Server) -> None:
+            url = f'{server.base_url}/drop-unvalidated'
+            async with utils.create_session() as session:
+                path = await utils.download_url(session, url, self.output)
+            self._assert_downloaded(path)
+            self.assertEqual(len(server.requests), 2)
+            self.assertNotIn('Range', server.requests[1])
+
+        self._run(test)
+
+    def test_partial_download_of_previous_run_is_resumed(self) -> None:
+        async def test(server: _Server) -> None:
+            url = f'{server.base_url}/a'
+            async with utils.create_session() as session:
+                async with session.head(url) as response:
+                    headers = response.headers
+                partial_path = utils._get_partial_path(self.output, url)
+                partial_path.write_bytes(PAYLOAD[:1000])
+                manifest = DownloadManifest(self.output)
+                manifest.set(url, self.output, partial_path, headers, partial=True)
+                manifest.save()
+                manifest = DownloadManifest(self.output)
+                path = await utils.download_url(session, url, self.output, manifest=manifest)
+            self._assert_downloaded(path)
+            self.assertEqual(server.requests[-1]['Range'], 'bytes=1000-')
+            self.assertEqual(server.statuses[-1], 206)
+
+        self._run(test)
+
+    def test_unsatisfiable_range_starts_over(self) -> None:
+        async def test(server: _Server) -> None:
+            url = f'{server.base_url}/a'
+            async with utils.create_session() as session:
+                async with session.head(url) as response:
+                    headers = response.headers
+                partial_path = utils._get_partial_path(self.output, url)
+                partial_path.write_bytes(PAYLOAD)  # Nothing is left to be requested.
+                manifest = DownloadManifest(self.output)
+                manifest.set(url, self.output, partial_path, headers, partial=True)
+                path = await utils.download_url(session, url, self.output, manifest=manifest)
+            self._assert_downloaded(path)
+            self.assertEqual(server.statuses[1:], [416, 200])
+            self.assertNotIn('Range', server.requests[-1])
+
+        self._run(test)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+import asyncio
+import typing
+import unittest
+from unittest import mock
+
+from vscod import extensions_downloader
+from vscod.cache import METADATA_CACHE
+
+
+class GetExtensionVersionsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        patcher = mock.patch.object(METADATA_CACHE, 'ttl', 0)  # Don't touch the on-disk cache.
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.fetched: typing.List[typing.List[str]] = []
+
+    def _patch_fetch(self, fetch: typing.Callable) -> None:
+        patcher = mock.patch.object(extensions_downloader, '_fetch_extension_versions', fetch)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_concurrent_calls_share_a_fetch(self) -> None:
+        async def fetch(session: None, extension_ids: typing.List[str]) -> typing.Dict[str, str]:
+            self.fetched.append(extension_ids)
+            await asyncio.sleep(0.01)
+            return {extension_id: '1.0.0' for extension_id in extension_ids}
+
+        self._patch_fetch(fetch)
+
+        async def test() -> None:
+            first, second = await asyncio.gather(
+                extensions_downloader.get_extension_versions(None, ['Foo.Bar', 'foo.bar']),
+                extensions_downloader.get_extension_versions(None, ['FOO.BAR']),
+            )
+            self.assertEqual(first, {'Foo.Bar': '1.0.0', 'foo.bar': '1.0.0'})
+            self.assertEqual(second, {'FOO.BAR': '1.0.0'})
+
+        asyncio.run(test())
+        self.assertEqual(self.fetched, [['Foo.Bar']])
+
+    def test_concurrent_call_gets_the_fetch_error(self) -> None:
+        async def fetch(session: None, extension_ids: typing.List[str]) -> typing.Dict[str, str]:
+            await asyncio.sleep(0.01)
+            raise RuntimeError('The marketplace is down')
+
+        self._patch_fetch(fetch)
+
+        async def test() -> None:
+            results = await asyncio.gather(
+                extensions_downloader.get_extension_versions(None, ['foo.bar']),
+                extensions_downloader.get_extension_versions(None, ['foo.bar']),
+                return_exceptions=True,
+            )
+            for result in results:
+                self.assertIsInstance(result, RuntimeError)
+
+        asyncio.run(test())
+
+    def test_concurrent_call_fetches_itself_when_the_fetch_is_cancelled(self) -> None:
+        started: typing.Optional[asyncio.Event] = None
+
+        async def fetch(session: None, extension_ids: typing.List[str]) -> typing.Dict[str, str]:
+            self.fetched.append(extension_ids)
+            if len(self.fetched) == 1:
+                started.set()
+                await asyncio.Event().wait()  # Hangs until cancelled.
+            return {extension_id: '1.0.0' for extension_id in extension_ids}
+
+        self._patch_fetch(fetch)
+
+        async def test() -> None:
+            nonlocal started
+            started = asyncio.Event()
+            first = asyncio.ensure_future(
+                extensions_downloader.get_extension_versions(None, ['foo.bar'])
+            )
+            await started.wait()
+            second = asyncio.ensure_future(
+                extensions_downloader.get_extension_versions(None, ['foo.bar'])
+            )
+            await asyncio.sleep(0.1)  # Let the second call wait for the first one's fetch.
+            first.cancel()
+            self.assertEqual(await second, {'foo.bar': '1.0.0'})
+            self.assertTrue(first.cancelled())
+
+        asyncio.run(test())
+        self.assertEqual(self.fetched, [['foo.bar'], ['foo.bar']])
+
+
+class PatchExtensionPathsTest(unittest.TestCase):
+    def setUp(self) -> None:
+        patcher = mock.patch.object(METADATA_CACHE, 'ttl', 0)  # Don't touch the on-disk cache.
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.requested_urls: typing.List[str] = []
+
+        async def get_versions(
+            session: None, extension_ids: typing.List[str]
+        ) -> typing.Dict[str, str]:
+            return {extension_id: '1.2.3' for extension_id in extension_ids}
+
+        async def get_filename(session: None, url: str) -> str:
+            self.requested_urls.append(url)
+            publisher_name, _, extension_name = url.split('/')[-5:-2]
+            return f'{publisher_name}.{extension_name}-1.2.3.vsix'
+
+        patcher = mock.patch.multiple(
+            extensions_downloader,
+            get_extension_versions=get_versions,
+            get_original_filename=get_filename,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _patch(self, *, versionize: bool) -> typing.List[extensions_downloader.ExtensionPath]:
+        extension_paths = [
+            extensions_downloader.ExtensionPath('editors/vim/vscodevim.vim', 'vscodevim.vim'),
+            extensions_downloader.ExtensionPath('also_vim/vscodevim.vim', 'vscodevim.vim'),
+            extensions_downloader.ExtensionPath('go/golang.go', 'golang.go', '0.1.0'),
+        ]
+        asyncio.run(
+            extensions_downloader.patch_extension_paths(
+                None, extension_paths, versionize=versionize
+            )
+        )
+        return extension_paths
+
+    def test_paths_are_named_and_versioned(self) -> None:
+        extension_paths = self._patch(versionize=True)
+        self.assertEqual(
+            [ext_path.path for ext_path in extension_paths],
+            [
+                'editors/vim/vscodevim.vim-1.2.3.vsix',
+                'also_vim/vscodevim.vim-1.2.3.vsix',
+                'go/golang.go-1.2.3.vsix',
+            ],
+        )
+        self.assertEqual({ext_path.version for ext_path in extension_paths}, {'1.2.3'})
+        # Names are requested from the unversioned urls alongside the versions, once per url.
+        self.assertEqual(len(self.requested_urls), 2)
+        self.assertIn('/vscodevim/vsextensions/vim/latest/vspackage', self.requested_urls[0])
+        self.assertIn('/golang/vsextensions/go/0.1.0/vspackage', self.requested_urls[1])
+
+    def test_paths_are_named_without_versioning(self) -> None:
+        extension_paths = self._patch(versionize=False)
+        self.assertEqual(extension_paths[0].path, 'editors/vim/vscodevim.vim-1.2.3.vsix')
+        self.assertEqual(
+            [ext_path.version for ext_path in extension_paths], ['latest', 'latest', '0.1.0']
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
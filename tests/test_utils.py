@@ -0,0 +1,182 @@
+import asyncio
+import os
+import tempfile
+import typing
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import aiohttp
+
+from vscod import utils
+
+PAYLOAD = os.urandom(3 * 1024 * 1024 + 123)  # Spans several write blocks.
+
+
+class _Content:
+    """
+    Stands in for a response's content stream, yielding the given data in network sized chunks.
+    """
+
+    def __init__(self, data: bytes) -> None:
+        self._data = data
+
+    async def iter_any(self) -> typing.AsyncIterator[bytes]:
+        for start in range(0, len(self._data), 64 * 1024):
+            await asyncio.sleep(0)
+            yield self._data[start : start + 64 * 1024]
+
+
+class StreamToFileTest(unittest.TestCase):
+    def setUp(self) -> None:
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.path = Path(temp_dir.name) / 'payload.bin'
+
+    def _stream(self, writer_type: typing.Type, data: bytes, offset: int = 0) -> None:
+        async def test() -> None:
+            save_file = await writer_type.open(self.path, offset)
+            try:
+                await utils._stream_to_file(_Content(data), save_file)
+            finally:
+                await save_file.close()
+
+        asyncio.run(test())
+
+    def _test_writer(self, writer_type: typing.Type) -> None:
+        self._stream(writer_type, PAYLOAD)
+        self.assertEqual(self.path.read_bytes(), PAYLOAD)
+        # Resuming writes after the offset and drops anything beyond it.
+        self.path.write_bytes(PAYLOAD[:1000] + b'stale data')
+        self._stream(writer_type, PAYLOAD[1000:], offset=1000)
+        self.assertEqual(self.path.read_bytes(), PAYLOAD)
+
+    def test_thread_writer(self) -> None:
+        self._test_writer(utils._ThreadFileWriter)
+
+    @unittest.skipIf(utils.caio is None, 'caio is not installed')
+    def test_caio_writer(self) -> None:
+        self._test_writer(utils._CaioFileWriter)
+
+
+class IOBackendTest(unittest.TestCase):
+    def _get_io_backend(self, value: str) -> typing.Tuple[str, bool]:
+        with mock.patch.dict(os.environ, {'VSCOD_IO_BACKEND': value}), mock.patch.object(
+            utils, 'logger'
+        ) as logger:
+            backend = utils._get_io_backend()
+        return backend, logger.warning.called
+
+    def test_thread_backend(self) -> None:
+        self.assertEqual(self._get_io_backend('thread'), ('thread', False))
+
+    def test_unknown_backend_warns(self) -> None:
+        self.assertEqual(self._get_io_backend('threads'), ('thread', True))
+
+    def test_missing_caio_warns(self) -> None:
+        with mock.patch.object(utils, 'caio', None):
+            self.assertEqual(self._get_io_backend('caio'), ('thread', True))
+
+    @unittest.skipIf(utils.caio is None, 'caio is not installed')
+    def test_caio_backend(self) -> None:
+        self.assertEqual(self._get_io_backend('caio'), ('caio', False))
+
+
+class RetryTest(unittest.TestCase):
+    def _retry_after(self, retry_after: str) -> typing.List[float]:
+        delays = []
+        attempts = 0
+
+        async def request() -> str:
+            nonlocal attempts
+            attempts += 1
+            if attempts == 1:
+                raise aiohttp.ClientResponseError(
+                    mock.Mock(), (), status=503, headers={'Retry-After': retry_after}
+                )
+            return 'done'
+
+        async def sleep(delay: float) -> None:
+            delays.append(delay)
+
+        with mock.patch.object(utils.asyncio, 'sleep', sleep):
+            self.assertEqual(asyncio.run(utils.retry(request)), 'done')
+        return delays
+
+    def test_retry_after_is_honored(self) -> None:
+        self.assertEqual(self._retry_after('2'), [2])
+
+    def test_retry_after_is_clamped(self) -> None:
+        self.assertEqual(self._retry_after('3600'), [utils.RETRY_MAX_DELAY])
+        self.assertEqual(
+            self._retry_after('Fri, 31 Dec 9999 23:59:59 GMT'), [utils.RETRY_MAX_DELAY]
+        )
+
+
+class GatherBoundedTest(unittest.TestCase):
+    def test_failure_cancels_and_closes_the_rest(self) -> None:
+        events = []
+
+        async def fail() -> None:
+            await asyncio.sleep(0.01)
+            raise RuntimeError('Failed')
+
+        async def slow() -> None:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                events.append('slow cancelled')
+                raise
+
+        async def queued() -> None:
+            events.append('queued started')
+
+        queued_coroutine = queued()
+
+        async def test() -> None:
+            with self.assertRaisesRegex(RuntimeError, 'Failed'):
+                await utils.gather_bounded(fail(), slow(), queued_coroutine, limit=2)
+
+        asyncio.run(test())
+        self.assertEqual(events, ['slow cancelled'])
+        self.assertIsNone(queued_coroutine.cr_frame)  # Closed without ever running.
+
+    def test_limit_is_respected(self) -> None:
+        running = 0
+        most_running = 0
+
+        async def work(value: int) -> int:
+            nonlocal running, most_running
+            running += 1
+            most_running = max(most_running, running)
+            await asyncio.sleep(0.001)
+            running -= 1
+            return value
+
+        results = asyncio.run(utils.gather_bounded(*[work(value) for value in range(10)], limit=3))
+        self.assertEqual(results, list(range(10)))
+        self.assertEqual(most_running, 3)
+
+    def test_cancelling_the_gather_cancels_the_awaitables(self) -> None:
+        cancelled = []
+
+        async def slow() -> None:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        async def test() -> None:
+            gather = asyncio.ensure_future(utils.gather_bounded(slow(), slow(), limit=2))
+            await asyncio.sleep(0.01)
+            gather.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await gather
+
+        asyncio.run(test())
+        self.assertEqual(cancelled, [True, True])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+from vscod import vscode_downloader
+from vscod.vscode_downloader import BUILDS, LATEST_VERSION, VSCodeSpec
+
+
+class ParseVSCodeJsonTest(unittest.TestCase):
+    def test_repeated_specs_are_kept_once(self) -> None:
+        specs = vscode_downloader.parse_vscode_json(
+            [
+                {'platform': 'linux-deb-x64'},
+                {'platform': 'win32-x64-user', 'build': 'insider'},
+                {'platform': 'linux-deb-x64', 'build': BUILDS.STABLE, 'version': LATEST_VERSION},
+                {'platform': 'linux-deb-x64', 'version': '1.37.1'},
+                {'platform': 'win32-x64-user', 'build': 'insider'},
+            ]
+        )
+        self.assertEqual(
+            specs,
+            [
+                VSCodeSpec('linux-deb-x64', BUILDS.STABLE, LATEST_VERSION),
+                VSCodeSpec('win32-x64-user', 'insider', LATEST_VERSION),
+                VSCodeSpec('linux-deb-x64', BUILDS.STABLE, '1.37.1'),
+            ],
+        )
+
+    def test_single_spec_dict(self) -> None:
+        self.assertEqual(
+            vscode_downloader.parse_vscode_json({'platform': 'darwin'}),
+            [VSCodeSpec('darwin', BUILDS.STABLE, LATEST_VERSION)],
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
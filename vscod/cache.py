@@ -0,0 +1,305 @@
+import atexit
+import json
+import math
+import os
+import threading
+import time
+import typing
+from pathlib import Path
+
+from loguru import logger
+
+# Where the metadata cache is persisted between runs.
+CACHE_PATH = Path(
+    os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache'), 'vscod', 'metadata.json'
+)
+
+# Seconds a cached entry stays valid for when `VSCOD_CACHE_TTL` doesn't set a valid amount.
+DEFAULT_CACHE_TTL = 60 * 60
+
+
+def _get_cache_ttl() -> float:
+    """
+    Get the cache TTL set by the `VSCOD_CACHE_TTL` environment variable.
+
+    :return: The set TTL in seconds, `DEFAULT_CACHE_TTL` if it's unset or invalid.
+    :rtype: float
+    """
+    value = os.environ.get('VSCOD_CACHE_TTL')
+    if value is None:
+        return DEFAULT_CACHE_TTL
+    try:
+        ttl = float(value)
+    except ValueError:
+        ttl = math.nan
+    if math.isnan(ttl):
+        logger.warning('Invalid VSCOD_CACHE_TTL {!r}, using {} instead.', value, DEFAULT_CACHE_TTL)
+        return DEFAULT_CACHE_TTL
+    return ttl
+
+
+# Seconds a cached entry stays valid for, a non positive value disables the cache.
+CACHE_TTL = _get_cache_ttl()
+
+
+class _MetadataCache:
+    """
+    A tiny on-disk cache for metadata fetched from the marketplace (versions, filenames...).
+    Entries are grouped by namespace, expire after the TTL and are persisted on exit.
+    """
+
+    def __init__(self, path: Path, ttl: float) -> None:
+        self.path = path
+        self.ttl = ttl
+        self._data: typing.Optional[typing.Dict[str, typing.Dict[str, list]]] = None
+        self._dirty = False
+        self._load_lock = threading.Lock()  # Concurrent calls may load from several threads.
+
+    def load(self) -> None:
+        """
+        Load the cache file if it wasn't loaded yet and the cache is enabled.
+        Call it ahead of time (off the event loop) to keep `get` and `set` from touching the disk.
+        """
+        with self._load_lock:
+            if self._data is None and self.ttl > 0:
+                try:
+                    self._data = json.loads(self.path.read_text())
+                except (OSError, ValueError):
+                    self._data = {}
+
+    def _entries(self, namespace: str) -> typing.Dict[str, list]:
+        """
+        Get the entries of a namespace, loading the cache file on first use.
+
+        :param namespace: The desired namespace.
+        :type namespace: str
+        :return: Dict of the namespace's keys to their [value, fetch time] entries.
+        :rtype: typing.Dict[str, list]
+        """
+        if self._data is None:
+            self.load()
+        return self._data.setdefault(namespace, {})
+
+    def get(self, namespace: str, key: str) -> typing.Optional[str]:
+        """
+        Get a cached value if it exists and hasn't expired.
+
+        :param namespace: The namespace the value is stored under.
+        :type namespace: str
+        :param key: The value's key.
+        :type key: str
+        :return: The cached value, None if there's no valid one.
+        :rtype: typing.Optional[str]
+        """
+        if self.ttl <= 0:
+            return None
+        entry = self._entries(namespace).get(key)
+        if entry is None:
+            return None
+        value, fetched_at = entry
+        if time.time() - fetched_at > self.ttl:
+            return None
+        return value
+
+    def set(self, namespace: str, key: str, value: str) -> None:
+        """
+        Cache a value, it will be persisted when the process exits.
+
+        :param namespace: The namespace to store the value under.
+        :type namespace: str
+        :param key: The value's key.
+        :type key: str
+        :param value: The value to cache.
+        :type value: str
+        """
+        if self.ttl <= 0:
+            return
+        self._entries(namespace)[key] = [value, time.time()]
+        if not self._dirty:
+            self._dirty = True
+            atexit.register(self.save)
+
+    def save(self) -> None:
+        """
+        Persist the cache to disk if it has changed, failing to do so only loses the cache.
+        """
+        if not self._dirty:
+            return
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = self.path.with_suffix('.tmp')
+            temp_path.write_text(json.dumps(self._data))
+            os.replace(temp_path, self.path)
+        except OSError as error:
+            logger.debug('Can\'t save the metadata cache: {}', error)
+        self._dirty = False
+
+
+METADATA_CACHE = _MetadataCache(CACHE_PATH, CACHE_TTL)  # Metadata cache singleton.
+
+
+class DownloadManifest:
+    """
+    Remembers the validators (`ETag` / `Last-Modified`) of the files downloaded into a directory,
+    so downloading them again can be skipped when the server says they haven't changed.
+    It's stored in a hidden file inside the directory itself, the entries are grouped by where
+    their urls were downloaded to so the same url can be downloaded to several places.
+    """
+
+    FILENAME = '.vscod-cache.json'
+    _save_lock = threading.Lock()  # Saves may run in worker threads and merge into the same file.
+
+    def __init__(self, directory: Path) -> None:
+        self.directory = directory
+        self.path = directory / self.FILENAME
+        self._entries: typing.Optional[typing.Dict[str, typing.Dict[str, dict]]] = None
+        self._updates: typing.Dict[str, typing.Dict[str, dict]] = {}
+
+    def load(self) -> typing.Dict[str, typing.Dict[str, dict]]:
+        """
+        Get the manifest's entries, loading the manifest file on first use.
+        Call it ahead of time (off the event loop) to keep `get` from touching the disk.
+
+        :return: Dict of destinations to dicts of urls to the entries describing their files.
+        :rtype: typing.Dict[str, typing.Dict[str, dict]]
+        """
+        if self._entries is None:
+            try:
+                self._entries = json.loads(self.path.read_text())
+            except (OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _relative(self, path: Path) -> str:
+        """
+        Get how a path is stored in the manifest, relative to it's directory when possible.
+
+        :param path: The path to store.
+        :type path: Path
+        :return: The path as stored in the manifest.
+        :rtype: str
+        """
+        try:
+            return path.relative_to(self.directory).as_posix()
+        except ValueError:
+            return str(path.resolve())
+
+    def _get_entry(self, url: str, destination: Path) -> typing.Optional[dict]:
+        """
+        Get the entry of a url downloaded to the given destination.
+
+        :param url: The downloaded url.
+        :type url: str
+        :param destination: Where the url was downloaded to, a file or a directory.
+        :type destination: Path
+        :return: The url's entry, None if it wasn't downloaded there before.
+        :rtype: typing.Optional[dict]
+        """
+        entries = self.load().get(self._relative(destination))
+        return entries.get(url) if isinstance(entries, dict) else None
+
+    def get(
+        self, url: str, destination: Path
+    ) -> typing.Optional[typing.Tuple[Path, typing.Dict[str, str]]]:
+        """
+        Get where a url was downloaded to and the headers making a conditional request for it.
+
+        :param url: The downloaded url.
+        :type url: str
+        :param destination: Where the url is downloaded to, a file or a directory.
+        :type destination: Path
+        :return: The downloaded file's path and the conditional request headers, None if the url
+            wasn't downloaded to the destination before.
+        :rtype: typing.Optional[typing.Tuple[Path, typing.Dict[str, str]]]
+        """
+        entry = self._get_entry(url, destination)
+        if entry is None or entry.get('partial'):
+            return None
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return self.directory / entry['path'], headers
+
+    def get_partial(self, url: str, destination: Path) -> typing.Optional[str]:
+        """
+        Get the validator to resume a url's partial download with, through `If-Range`.
+
+        :param url: The partially downloaded url.
+        :type url: str
+        :param destination: Where the url is downloaded to, a file or a directory.
+        :type destination: Path
+        :return: The validator of the partial download, None if there's no resumable one.
+        :rtype: typing.Optional[str]
+        """
+        entry = self._get_entry(url, destination)
+        if entry is None or not entry.get('partial'):
+            return None
+        return entry['etag'] or entry['last_modified'] or None
+
+    def set(
+        self,
+        url: str,
+        destination: Path,
+        file_path: Path,
+        headers: typing.Mapping[str, str],
+        *,
+        partial: bool = False,
+    ) -> None:
+        """
+        Record that a url was downloaded to the given file, along with the response's validators.
+
+        :param url: The downloaded url.
+        :type url: str
+        :param destination: Where the url is downloaded to, a file or a directory.
+        :type destination: Path
+        :param file_path: The file the url was downloaded to.
+        :type file_path: Path
+        :param headers: The download's response headers.
+        :type headers: typing.Mapping[str, str]
+        :param partial: Wether the file is only partially downloaded yet, defaults to False
+        :type partial: bool, optional
+        """
+        if not headers.get('ETag') and not headers.get('Last-Modified'):
+            return
+        etag = headers.get('ETag', '')
+        if partial and etag.startswith('W/'):
+            etag = ''  # `If-Range` only accepts strong validators.
+        entry = {
+            'path': self._relative(file_path),
+            'etag': etag,
+            'last_modified': headers.get('Last-Modified', ''),
+        }
+        if partial:
+            entry['partial'] = True
+        destination_key = self._relative(destination)
+        entries = self.load()
+        if not isinstance(entries.get(destination_key), dict):
+            entries[destination_key] = {}
+        entries[destination_key][url] = entry
+        self._updates.setdefault(destination_key, {})[url] = entry
+
+    def save(self) -> None:
+        """
+        Persist the entries set since the last save, merged into the manifest's current file
+        so others saving to the same directory aren't overwritten.
+        """
+        if not self._updates:
+            return
+        updates, self._updates = self._updates, {}
+        with self._save_lock:
+            try:
+                entries = json.loads(self.path.read_text())
+            except (OSError, ValueError):
+                entries = {}
+            for destination_key, destination_updates in updates.items():
+                if not isinstance(entries.get(destination_key), dict):
+                    entries[destination_key] = {}
+                entries[destination_key].update(destination_updates)
+            try:
+                temp_path = self.path.with_suffix('.tmp')
+                temp_path.write_text(json.dumps(entries))
+                os.replace(temp_path, self.path)
+            except OSError as error:
+                logger.debug('Can\'t save the download manifest: {}', error)
@@ -1,6 +1,6 @@
 import asyncio
 import dataclasses
-import json
+import posixpath
 import re
 import typing
 from pathlib import Path
@@ -8,39 +8,81 @@ from pathlib import Path
 import aiohttp
 from loguru import logger
 
-from .utils import download_url, get_request, get_original_filename
+from .cache import METADATA_CACHE, DownloadManifest
+from .utils import (
+    DATACLASS_SLOTS,
+    create_session,
+    download_url,
+    gather_bounded,
+    get_original_filename,
+    load_json_file,
+    make_directories,
+    retry,
+    run_in_thread,
+    search_url,
+)
+
+# Link to the marketplace API listing the extensions of each publisher.
+MARKETPLACE_PUBLISHERS_LINK = 'https://marketplace.visualstudio.com/_apis/public/gallery/publishers'
 
 # Format string linking to the download of a vscode extension .vsix file.
-MARKETPLACE_DOWNLOAD_LINK = '''
-    https://marketplace.visualstudio.com/_apis/public/gallery/publishers/{publisher_name}/vsextensions/{extension_name}/{version}/vspackage
-'''.strip()
+MARKETPLACE_DOWNLOAD_LINK = (
+    MARKETPLACE_PUBLISHERS_LINK
+    + '/{publisher_name}/vsextensions/{extension_name}/{version}/vspackage'
+)
 
 # Format string linking to the marketplace page of some extension.
-MARKETPLACE_PAGE_LINK = '''
-    https://marketplace.visualstudio.com/items?itemName={extension_id}
-'''.strip()
+MARKETPLACE_PAGE_LINK = 'https://marketplace.visualstudio.com/items?itemName={extension_id}'
+
+# Link to the marketplace API endpoint used to query extensions metadata in batches.
+MARKETPLACE_QUERY_LINK = 'https://marketplace.visualstudio.com/_apis/public/gallery/extensionquery'
+
+# Headers required by the marketplace query API.
+MARKETPLACE_QUERY_HEADERS = {'Accept': 'application/json;api-version=6.1-preview.1'}
+
+# Marketplace query filter type matching an extension by it's full `publisher.name` ID.
+_QUERY_FILTER_EXTENSION_NAME = 7
+
+# Marketplace query flag making the results contain only the latest version of each extension.
+_QUERY_FLAG_LATEST_VERSION_ONLY = 0x200
+
+# Futures of the versions currently being fetched, by lowercase extension ID.
+_pending_versions: typing.Dict[str, 'asyncio.Future[str]'] = {}
 
 # Regex used to extract the exact version of an extension from it's marketplace page.
-VERSION_REGEX = re.compile(r'"Version":"(.*?)"')
+VERSION_REGEX = re.compile(rb'"Version":"(.*?)"')
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(**DATACLASS_SLOTS)
 class ExtensionPath:
     """
     Dataclass for storing info regarding a certain VSCode extension.
     """
 
-    path: Path  # Extension final save path.
+    path: str  # Extension final save path, relative and '/' separated.
     extension_id: str  # Extension ID.
     version: str = 'latest'  # Extension version.
 
 
+def _add_vsix_suffix(path: str) -> str:
+    """
+    Make sure the given path ends with the .vsix suffix.
+    Extension IDs contain a dot so the suffix is appended rather than replacing the "last" one.
+
+    :param path: The path to add the suffix to.
+    :type path: str
+    :return: The path with the .vsix suffix.
+    :rtype: str
+    """
+    return path if path.endswith('.vsix') else f'{path}.vsix'
+
+
 def _build_extension_download_url(
     extension_name: str, publisher_name: str, version: str
 ) -> str:
     """
     Build the download url for the given parameters.
-    Just a shortcut for the string formatting.
+    Same as formatting `MARKETPLACE_DOWNLOAD_LINK`, without parsing the template on every call.
 
     :param extension_name: Desired extension name.
     :type extension_name: str
@@ -51,8 +93,9 @@ def _build_extension_download_url(
     :return: The formatted download url.
     :rtype: str
     """
-    return MARKETPLACE_DOWNLOAD_LINK.format(
-        extension_name=extension_name, publisher_name=publisher_name, version=version
+    return (
+        f'{MARKETPLACE_PUBLISHERS_LINK}/{publisher_name}'
+        f'/vsextensions/{extension_name}/{version}/vspackage'
     )
 
 
@@ -75,6 +118,8 @@ async def _download_extension(
     publisher_name: str,
     version: str,
     save_path: Path,
+    *,
+    manifest: typing.Optional[DownloadManifest] = None,
 ) -> None:
     """
     Download an extension according to the given parameters.
@@ -88,19 +133,27 @@ async def _download_extension(
     :type publisher_name: str
     :param version: Desired extension version.
     :type version: str
-    :param save_path: Save path to downloaded the desired extension to.
+    :param save_path: Save path to downloaded the desired extension to, if it's an existing
+        directory the extension is saved inside it under it's original name.
     :type save_path: Path
+    :param manifest: The manifest of the directory being downloaded into, defaults to None
+    :type manifest: typing.Optional[DownloadManifest], optional
     :return: None.
     :rtype: None
     """
-    logger.info(f'Downloading {extension_name}...')
+    logger.info('Downloading {}...', extension_name)
     url = _build_extension_download_url(extension_name, publisher_name, version)
-    await download_url(session, url, save_path, return_type=bytes)
-    logger.info(f'Downloaded {extension_name} to {save_path}.')
+    extension_path = await download_url(session, url, save_path, manifest=manifest)
+    logger.info('Downloaded {} to {}.', extension_name, extension_path)
 
 
 async def download_extension_by_id(
-    session: aiohttp.ClientSession, extension_id: str, version: str, save_path: Path
+    session: aiohttp.ClientSession,
+    extension_id: str,
+    version: str,
+    save_path: Path,
+    *,
+    manifest: typing.Optional[DownloadManifest] = None,
 ) -> None:
     """
     Download an extension according to the given parameters.
@@ -111,24 +164,30 @@ async def download_extension_by_id(
     :type extension_id: str
     :param version: Desired extension version.
     :type version: str
-    :param save_path: Save path to downloaded the desired extension to.
+    :param save_path: Save path to downloaded the desired extension to, if it's an existing
+        directory the extension is saved inside it under it's original name.
     :type save_path: Path
+    :param manifest: The manifest of the directory being downloaded into, defaults to None
+    :type manifest: typing.Optional[DownloadManifest], optional
     :return: None.
     :rtype: None
     """
     publisher_name, extension_name = extension_id.split('.')
-    await _download_extension(session, extension_name, publisher_name, version, save_path)
+    await _download_extension(
+        session, extension_name, publisher_name, version, save_path, manifest=manifest
+    )
 
 
-def _recursive_parse_to_dict(
+def _parse_extensions_dict(
     root_dict: typing.Dict[str, typing.Union[str, typing.Dict]],
 ) -> typing.List[ExtensionPath]:
     """
-    Recursively parse the given config data:
+    Walk the given config data depth first:
     If the value of a key is a dict, treat it like a directory and delve one level deeper into the value.
     If the value of a key is a string, create a spec object from it and give it it's "path" down the hierarchy.
+    The keys leading to a value are gathered as it's walked so each spec's path is only built once.
 
-    :param root_dict: The current "root" of our config.
+    :param root_dict: The "root" of our config.
     :type root_dict: typing.Dict[str, typing.Union[str, typing.Dict]]
     :raises ValueError: A given key had an empty value.
     :raises TypeError: A given key was neither a str or a dict.
@@ -136,17 +195,22 @@ def _recursive_parse_to_dict(
     :rtype: typing.List[ExtensionPath]
     """
     path_list = []
-    for key, value in root_dict.items():
-        if isinstance(value, str):
-            if not value:
-                raise ValueError(f'Value for key {key} was empty.')
-            path_list.append(ExtensionPath(Path(key) / f'{value}', value))
-        elif isinstance(value, dict):
-            for ext_path in _recursive_parse_to_dict(value):
-                ext_path.path = Path(key, ext_path.path)
-                path_list.append(ext_path)
+    # Each frame holds the keys leading to a dict and an iterator over the dict's items.
+    stack = [((), iter(root_dict.items()))]
+    while stack:
+        parent_keys, items = stack[-1]
+        for key, value in items:
+            if isinstance(value, str):
+                if not value:
+                    raise ValueError(f'Value for key {key} was empty.')
+                path_list.append(ExtensionPath(posixpath.join(*parent_keys, key, value), value))
+            elif isinstance(value, dict):
+                stack.append((parent_keys + (key,), iter(value.items())))
+                break
+            else:
+                raise TypeError(f'Value for key {key} was neither str or dict.')
         else:
-            raise TypeError(f'Value for key {key} was neither str or dict.')
+            stack.pop()
     return path_list
 
 
@@ -156,7 +220,8 @@ def parse_extensions_json(
     """
     Decide wether the data provided was a Path or not and act accordingly:
     If it's valid json format data, parse it and return a list of specs.
-    If it's a Path, open it and then do the same thing.
+    If it's a Path, open it and then do the same thing, a config without a "extensions" section
+    has no extensions to download.
 
     :param json_data: Either a path to a json config file or it's raw data (dict / list).
     :type json_data: typing.Union[typing.Dict[str, str], Path]
@@ -164,39 +229,199 @@ def parse_extensions_json(
     :rtype: typing.List[ExtensionPath]
     """
     if isinstance(json_data, Path):
-        with json_data.open() as json_file:
-            json_data = json.load(json_file)['extensions']
-    return _recursive_parse_to_dict(json_data)
+        json_data = load_json_file(json_data).get('extensions', {})
+    return _parse_extensions_dict(json_data)
 
 
-async def get_extension_version(session: aiohttp.ClientSession, extension_id: str) -> str:
+async def _scrape_extension_version(session: aiohttp.ClientSession, extension_id: str) -> str:
     """
-    Get the latest version of an extension on the marketplace.
+    Get the latest version of an extension by scraping it's marketplace page.
 
     :param session: An aiohttp session object to use.
     :type session: aiohttp.ClientSession
     :param extension_id: Desired marketplace extension to get the version of.
     :type extension_id: str
-    :raises ValueError: Can't find the extension version.
-    :return: String of the extension's latest version.
+    :return: String of the extension's latest version, or 'latest' if it can't be found.
     :rtype: str
     """
-    logger.debug(f'Requesting version of extension {extension_id}...')
+    logger.debug('Scraping version of extension {}...', extension_id)
     url = MARKETPLACE_PAGE_LINK.format(extension_id=extension_id)
     try:
-        text: str = await get_request(session, url, return_type=str)
-        match = re.search(r'"Version":"(.*?)"', text)
+        match = await search_url(session, url, VERSION_REGEX)
         if not match:
             raise ValueError('Extension marketplace page data doesn\'t contain a version.')
-        version = match.group(1)  # The captured version specifier.
+        version = match.group(1).decode()  # The captured version specifier.
     except Exception as error:
         logger.debug(error)
         logger.warning('Can\'t get extension version, setting version to \'latest\'...')
         version = 'latest'
-    logger.debug(f'Extension {extension_id} is of version {version}.')
     return version
 
 
+async def _query_extension_versions(
+    session: aiohttp.ClientSession, extension_ids: typing.List[str]
+) -> typing.Dict[str, str]:
+    """
+    Query the marketplace API for the latest versions of several extensions in a single request.
+
+    :param session: An aiohttp session object to use.
+    :type session: aiohttp.ClientSession
+    :param extension_ids: Desired marketplace extensions to get the versions of.
+    :type extension_ids: typing.List[str]
+    :return: Dict of the lowercase IDs of the found extensions to their latest version.
+    :rtype: typing.Dict[str, str]
+    """
+    query = {
+        'filters': [
+            {
+                'criteria': [
+                    {'filterType': _QUERY_FILTER_EXTENSION_NAME, 'value': extension_id}
+                    for extension_id in extension_ids
+                ],
+                'pageNumber': 1,
+                'pageSize': len(extension_ids),
+            }
+        ],
+        'flags': _QUERY_FLAG_LATEST_VERSION_ONLY,
+    }
+
+    async def _post_query() -> typing.Dict[str, typing.Any]:
+        async with session.post(
+            MARKETPLACE_QUERY_LINK, json=query, headers=MARKETPLACE_QUERY_HEADERS
+        ) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    data = await retry(_post_query)
+    versions = {}
+    for extension in data['results'][0]['extensions']:
+        extension_id = f'{extension["publisher"]["publisherName"]}.{extension["extensionName"]}'
+        versions[extension_id.lower()] = extension['versions'][0]['version']
+    return versions
+
+
+async def _fetch_extension_versions(
+    session: aiohttp.ClientSession, extension_ids: typing.List[str]
+) -> typing.Dict[str, str]:
+    """
+    Fetch the latest versions of several extensions from the marketplace.
+    All of them are queried in one batched request, extensions it couldn't resolve fallback on
+    scraping their marketplace pages.
+
+    :param session: An aiohttp session object to use.
+    :type session: aiohttp.ClientSession
+    :param extension_ids: Desired marketplace extensions to get the versions of.
+    :type extension_ids: typing.List[str]
+    :return: Dict of the given extension IDs to their latest version ('latest' if not found).
+    :rtype: typing.Dict[str, str]
+    """
+    logger.debug('Requesting versions of extensions {}...', extension_ids)
+    try:
+        queried_versions = await _query_extension_versions(session, extension_ids)
+    except Exception as error:
+        logger.debug(error)
+        logger.warning('Can\'t query the marketplace, scraping extension pages instead...')
+        queried_versions = {}
+    versions = {}
+    missing_ids = []
+    for extension_id in extension_ids:
+        version = queried_versions.get(extension_id.lower())
+        if version:
+            versions[extension_id] = version
+        else:
+            missing_ids.append(extension_id)
+    scraped_versions = await gather_bounded(
+        *[_scrape_extension_version(session, extension_id) for extension_id in missing_ids]
+    )
+    versions.update(zip(missing_ids, scraped_versions))
+    for extension_id, version in versions.items():
+        logger.debug('Extension {} is of version {}.', extension_id, version)
+        if version != 'latest':
+            METADATA_CACHE.set('versions', extension_id.lower(), version)
+    return versions
+
+
+async def get_extension_versions(
+    session: aiohttp.ClientSession, extension_ids: typing.List[str]
+) -> typing.Dict[str, str]:
+    """
+    Get the latest versions of several extensions on the marketplace.
+    Cached versions are used as is and extensions already being fetched by a concurrent call
+    share it's result, only the rest are fetched.
+
+    :param session: An aiohttp session object to use.
+    :type session: aiohttp.ClientSession
+    :param extension_ids: Desired marketplace extensions to get the versions of.
+    :type extension_ids: typing.List[str]
+    :return: Dict of the given extension IDs to their latest version ('latest' if not found).
+    :rtype: typing.Dict[str, str]
+    """
+    await run_in_thread(METADATA_CACHE.load)
+    versions = {}
+    pending_versions = {}
+    fetched_ids = {}  # The lowercase IDs mapped to the first given ID fetched for each of them.
+    aliased_ids = {}  # IDs only differing in case from a fetched one, mapped to that one.
+    for extension_id in dict.fromkeys(extension_ids):
+        key = extension_id.lower()  # IDs are case insensitive, only request each extension once.
+        version = METADATA_CACHE.get('versions', key)
+        if version:
+            versions[extension_id] = version
+        elif key in _pending_versions:
+            pending_versions[extension_id] = _pending_versions[key]
+        elif key in fetched_ids:
+            aliased_ids[extension_id] = fetched_ids[key]
+        else:
+            fetched_ids[key] = extension_id
+    loop = asyncio.get_running_loop()
+    fetched_futures = {key: loop.create_future() for key in fetched_ids}
+    _pending_versions.update(fetched_futures)
+    try:
+        if fetched_ids:
+            versions.update(await _fetch_extension_versions(session, list(fetched_ids.values())))
+        for key, extension_id in fetched_ids.items():
+            fetched_futures[key].set_result(versions[extension_id])
+    except BaseException as error:
+        # Concurrent calls waiting for these versions fail the same way, unless this call was
+        # cancelled, then they fetch the versions themselves.
+        for future in fetched_futures.values():
+            if future.done():
+                continue
+            if isinstance(error, asyncio.CancelledError):
+                future.cancel()
+            else:
+                future.set_exception(error)
+                future.exception()  # Retrieved by this call, don't warn if nobody else waits.
+        raise
+    finally:
+        for key in fetched_futures:
+            del _pending_versions[key]
+    for extension_id, fetched_id in aliased_ids.items():
+        versions[extension_id] = versions[fetched_id]
+    for extension_id, future in pending_versions.items():
+        try:
+            versions[extension_id] = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                raise  # This call itself was cancelled.
+            versions.update(await get_extension_versions(session, [extension_id]))
+    return versions
+
+
+async def get_extension_version(session: aiohttp.ClientSession, extension_id: str) -> str:
+    """
+    Get the latest version of an extension on the marketplace.
+
+    :param session: An aiohttp session object to use.
+    :type session: aiohttp.ClientSession
+    :param extension_id: Desired marketplace extension to get the version of.
+    :type extension_id: str
+    :return: String of the extension's latest version ('latest' if not found).
+    :rtype: str
+    """
+    versions = await get_extension_versions(session, [extension_id])
+    return versions[extension_id]
+
+
 async def versionize_extension_paths(
     session: aiohttp.ClientSession, extension_paths: typing.List[ExtensionPath]
 ) -> None:
@@ -210,12 +435,52 @@ async def versionize_extension_paths(
     :return: None, this patches the existing objects.
     :rtype: None
     """
-    get_version_tasks = [
-        get_extension_version(session, ext_path.extension_id) for ext_path in extension_paths
-    ]
-    versions = await asyncio.gather(*get_version_tasks)
-    for ext_path, version in zip(extension_paths, versions):
-        ext_path.version = version
+    versions = await get_extension_versions(
+        session, [ext_path.extension_id for ext_path in extension_paths]
+    )
+    for ext_path in extension_paths:
+        ext_path.version = versions[ext_path.extension_id]
+
+
+def _is_pinned(url: str) -> bool:
+    """
+    Check whether a download link points to a concrete version of an extension.
+    What 'latest' points to changes over time, so only the filenames of pinned links are cached.
+
+    :param url: The download link to check.
+    :type url: str
+    :return: True if the link isn't of the 'latest' version.
+    :rtype: bool
+    """
+    return '/latest/' not in url
+
+
+async def _get_original_filenames(
+    session: aiohttp.ClientSession, urls: typing.List[str]
+) -> typing.Dict[str, str]:
+    """
+    Get the original filenames of several download links, requesting each distinct one only once.
+
+    :param session: An aiohttp session object to use.
+    :type session: aiohttp.ClientSession
+    :param urls: The desired urls to get the filenames of.
+    :type urls: typing.List[str]
+    :return: Dict of the given urls to their original filenames.
+    :rtype: typing.Dict[str, str]
+    """
+    await run_in_thread(METADATA_CACHE.load)
+    filenames_by_url = {
+        url: METADATA_CACHE.get('filenames', url) if _is_pinned(url) else None for url in urls
+    }
+    uncached_urls = [url for url, filename in filenames_by_url.items() if not filename]
+    original_filenames = await gather_bounded(
+        *[get_original_filename(session, url) for url in uncached_urls]
+    )
+    for url, filename in zip(uncached_urls, original_filenames):
+        filenames_by_url[url] = filename
+        if _is_pinned(url):
+            METADATA_CACHE.set('filenames', url, filename)
+    return filenames_by_url
 
 
 async def patch_extension_paths(
@@ -228,6 +493,10 @@ async def patch_extension_paths(
     Fix up the extension paths by altering their name.
     Basic functionality is to get the real names of extensions.
     Can also append the current version number.
+    The names are requested alongside the versions, the marketplace already resolves the
+    'latest' version of a link by itself and names it's file accordingly.
+    This is a standalone helper for finding the names without downloading anything,
+    `download_extensions_json` names the files from the download responses themselves.
 
     :param session: An aiohttp session object to use.
     :type session: aiohttp.ClientSession
@@ -238,15 +507,18 @@ async def patch_extension_paths(
     :return: None, this patches the existing objects.
     :rtype: None
     """
-    if versionize:
-        await versionize_extension_paths(session, extension_paths)
-    real_name_tasks = [
-        get_original_filename(session, _build_extension_download_url_from_ext_path(ext_path))
-        for ext_path in extension_paths
+    download_urls = [
+        _build_extension_download_url_from_ext_path(ext_path) for ext_path in extension_paths
     ]
-    original_filenames = await asyncio.gather(*real_name_tasks)
-    for filename, ext_path in zip(original_filenames, extension_paths):
-        ext_path.path = ext_path.path.with_name(filename)
+    if versionize:
+        _, filenames_by_url = await asyncio.gather(
+            versionize_extension_paths(session, extension_paths),
+            _get_original_filenames(session, download_urls),
+        )
+    else:
+        filenames_by_url = await _get_original_filenames(session, download_urls)
+    for ext_path, url in zip(extension_paths, download_urls):
+        ext_path.path = posixpath.join(posixpath.dirname(ext_path.path), filenames_by_url[url])
 
 
 async def download_extensions_json(
@@ -255,6 +527,7 @@ async def download_extensions_json(
     *,
     real_name: typing.Optional[bool] = None,
     versionize: typing.Optional[bool] = None,
+    session: typing.Optional[aiohttp.ClientSession] = None,
 ) -> None:
     """
     Parse the given json data and download the given VSCode extensions into the save path.
@@ -267,24 +540,48 @@ async def download_extensions_json(
     :type real_name: typing.Optional[bool], optional
     :param versionize: Wether to patch the current version of the extensions, has no effect without `real_name`, defaults to None (True)
     :type versionize: typing.Optional[bool], optional
+    :param session: An aiohttp session object to use, defaults to None (create a new one)
+    :type session: typing.Optional[aiohttp.ClientSession], optional
     :return: None.
     :rtype: None
     """
+    if session is None:
+        async with create_session() as session:
+            return await download_extensions_json(
+                json_data, save_path, real_name=real_name, versionize=versionize, session=session
+            )
     if real_name is None:
         real_name = True
     if versionize is None:
         versionize = True
     extension_paths = parse_extensions_json(json_data)
-    async with aiohttp.ClientSession() as session:
-        if real_name:
-            await patch_extension_paths(session, extension_paths, versionize=versionize)
-        download_extension_tasks = []
-        for ext_path in extension_paths:
-            extension_full_save_path = save_path / ext_path.path.with_suffix('.vsix')
-            extension_full_save_path.parent.mkdir(parents=True, exist_ok=True)
-            download_extension_tasks.append(
-                download_extension_by_id(
-                    session, ext_path.extension_id, ext_path.version, extension_full_save_path
-                )
-            )
-        await asyncio.gather(*download_extension_tasks)
+    if real_name:
+        # The real filenames come with the download responses themselves, so the extensions are
+        # downloaded into their directories right away instead of being named beforehand.
+        if versionize:
+            await versionize_extension_paths(session, extension_paths)
+        extension_full_save_paths = [
+            save_path / posixpath.dirname(ext_path.path) for ext_path in extension_paths
+        ]
+        await make_directories(extension_full_save_paths)
+    else:
+        extension_full_save_paths = [
+            save_path / _add_vsix_suffix(ext_path.path) for ext_path in extension_paths
+        ]
+        await make_directories(path.parent for path in extension_full_save_paths)
+    manifest = DownloadManifest(save_path)
+    await run_in_thread(manifest.load)
+    download_extension_tasks = [
+        download_extension_by_id(
+            session,
+            ext_path.extension_id,
+            ext_path.version,
+            extension_full_save_path,
+            manifest=manifest,
+        )
+        for ext_path, extension_full_save_path in zip(extension_paths, extension_full_save_paths)
+    ]
+    try:
+        await gather_bounded(*download_extension_tasks)
+    finally:
+        await run_in_thread(manifest.save)
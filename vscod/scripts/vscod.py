@@ -1,23 +1,60 @@
 import asyncio
 import functools
+import sys
 import typing
 from pathlib import Path
 
 import click
 
+try:
+    import uvloop
+except ImportError:  # Optional speedup, the default event loop is used without it.
+    uvloop = None
+
 from ..extensions_downloader import download_extensions_json
-from ..utils import configure_verbosity
-from ..vscode_downloader import BUILDS, LATEST_VERSION, PLATFORMS, download_vscode_json
+from ..utils import (
+    CONCURRENCY_LIMIT,
+    configure_concurrency,
+    configure_verbosity,
+    create_session,
+    gather_bounded,
+)
+from ..vscode_downloader import (
+    BUILD_CHOICES,
+    BUILD_OPTIONS,
+    BUILDS,
+    LATEST_VERSION,
+    PLATFORM_CHOICES,
+    PLATFORM_OPTIONS,
+    download_vscode_json,
+)
 
 
-def coroutine(
-    async_func: typing.Callable, *args: typing.Any, **kwargs: typing.Any
-) -> typing.Callable:
+def _run(main: typing.Awaitable) -> typing.Any:
+    """
+    Run a coroutine in a new event loop, a uvloop one if it's installed.
+    """
+    if uvloop is None:
+        return asyncio.run(main)
+    if hasattr(uvloop, 'run'):
+        return uvloop.run(main)
+    if sys.version_info >= (3, 11):
+        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+            return runner.run(main)
+    # Older Pythons (with an older uvloop) can only choose the loop through the global policy.
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    try:
+        return asyncio.run(main)
+    finally:
+        asyncio.set_event_loop_policy(None)
+
+
+def coroutine(async_func: typing.Callable) -> typing.Callable:
     @functools.wraps(async_func)
-    def func(*args, **kwargs):
-        return asyncio.run(async_func(*args, **kwargs))
+    def wrapper(*args: typing.Any, **kwargs: typing.Any) -> typing.Any:
+        return _run(async_func(*args, **kwargs))
 
-    return func
+    return wrapper
 
 
 @click.group()
@@ -25,8 +62,17 @@ def coroutine(
 @click.option(
     '--quiet', is_flag=True, help='Make the downloader shut up. Overrides `verbose`.'
 )
-def cli(verbose: bool, quiet: bool):
+@click.option(
+    '-j',
+    '--concurrency',
+    type=click.IntRange(min=1),
+    default=CONCURRENCY_LIMIT,
+    show_default=True,
+    help='How many requests to run at once per batch of downloads and per host.',
+)
+def cli(verbose: bool, quiet: bool, concurrency: int):
     configure_verbosity('DEBUG' if verbose else 'INFO', quiet=quiet)
+    configure_concurrency(concurrency)
 
 
 @cli.group()
@@ -46,8 +92,11 @@ def download():
 )
 @coroutine
 async def config(config_path: str, output_path: str):
-    await download_vscode_json(Path(config_path), Path(output_path))
-    await download_extensions_json(Path(config_path), Path(output_path))
+    async with create_session() as session:
+        await gather_bounded(
+            download_vscode_json(Path(config_path), Path(output_path), session=session),
+            download_extensions_json(Path(config_path), Path(output_path), session=session),
+        )
 
 
 @download.command()
@@ -67,22 +116,12 @@ async def extensions(extension_ids: typing.List[str], output_path: str):
     await download_extensions_json(config_dict, output_path)
 
 
-def _get_constant_values(obj) -> typing.List[typing.Tuple[str, str]]:
-    ret_list = []
-    for k, v in obj.__class__.__dict__.items():
-        if not k.startswith('__'):
-            ret_list.append(v)
-    return ret_list
-
-
 @download.command()
-@click.argument(
-    'platforms', type=click.Choice(_get_constant_values(PLATFORMS)), required=True, nargs=-1
-)
+@click.argument('platforms', type=click.Choice(PLATFORM_CHOICES), required=True, nargs=-1)
 @click.option(
     '-b',
     '--build',
-    type=click.Choice(_get_constant_values(BUILDS)),
+    type=click.Choice(BUILD_CHOICES),
     required=False,
     default=BUILDS.STABLE,
     show_default=True,
@@ -116,10 +155,9 @@ async def editor(
     await download_vscode_json(config_list, output_path)
 
 
-def _print_constants(obj) -> None:
-    for k, v in obj.__class__.__dict__.items():
-        if not k.startswith('__'):
-            click.echo(f'{k}: "{v}"')
+def _print_constants(constants: typing.Dict[str, str]) -> None:
+    for k, v in constants.items():
+        click.echo(f'{k}: "{v}"')
 
 
 @cli.command()
@@ -131,7 +169,7 @@ def list_opts(platforms: bool, builds: bool):
         builds = True
     if platforms:
         click.echo('=== PLATFORM OPTIONS ===')
-        _print_constants(PLATFORMS)
+        _print_constants(PLATFORM_OPTIONS)
     if builds:
         click.echo('{}=== BUILDS OPTIONS ==='.format('\n' if platforms else ''))
-        _print_constants(BUILDS)
+        _print_constants(BUILD_OPTIONS)
@@ -1,29 +1,647 @@
-import re
+import asyncio
+import email.utils
+import functools
+import hashlib
+import json
+import os
+import random
 import sys
+import time
 import typing
+from http import HTTPStatus
 from pathlib import Path
 
-import aiofiles
 import aiohttp
 from loguru import logger
 
+if typing.TYPE_CHECKING:
+    from .cache import DownloadManifest
+
+try:
+    import orjson
+except ImportError:  # orjson is an optional speedup, fallback on the standard library.
+    orjson = None
+
+try:
+    import aiodns
+except ImportError:  # Without aiodns hostnames are resolved in a thread pool instead.
+    aiodns = None
+
+try:
+    import caio
+except ImportError:  # caio is an optional (opt-in) disk write backend.
+    caio = None
+
+# Keyword arguments making dataclasses use `__slots__`, which is only supported since Python 3.10.
+DATACLASS_SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+# Requests in flight at once per batch and per host, unless `VSCOD_CONCURRENCY` sets a valid limit.
+DEFAULT_CONCURRENCY_LIMIT = 16
+
+
+def _get_concurrency_limit() -> int:
+    """
+    Get the concurrency limit set by the `VSCOD_CONCURRENCY` environment variable.
+
+    :return: The set limit, `DEFAULT_CONCURRENCY_LIMIT` if it's unset or invalid.
+    :rtype: int
+    """
+    value = os.environ.get('VSCOD_CONCURRENCY')
+    if value is None:
+        return DEFAULT_CONCURRENCY_LIMIT
+    try:
+        limit = int(value)
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        logger.warning(
+            'Invalid VSCOD_CONCURRENCY {!r}, using {} instead.', value, DEFAULT_CONCURRENCY_LIMIT
+        )
+        return DEFAULT_CONCURRENCY_LIMIT
+    return limit
+
+
+# Maximum amount of requests in flight at once, matched to the per-host connection limit.
+CONCURRENCY_LIMIT = _get_concurrency_limit()
+
+# Seconds to keep resolved hosts cached for, long enough to cover a whole run.
+DNS_CACHE_TTL = 600
+
+# How many times a request is attempted before giving up on it.
+RETRY_ATTEMPTS = 5
+
+# Upper bound in seconds for the wait between attempts, be it the backoff or `Retry-After`.
+RETRY_MAX_DELAY = 30
+
+# Response statuses signaling a transient failure that's worth retrying.
+RETRY_STATUSES = frozenset(
+    (
+        HTTPStatus.TOO_MANY_REQUESTS,
+        HTTPStatus.BAD_GATEWAY,
+        HTTPStatus.SERVICE_UNAVAILABLE,
+        HTTPStatus.GATEWAY_TIMEOUT,
+    )
+)
+
+T = typing.TypeVar('T')
+
+# Size of the chunks responses are searched in.
+SEARCH_CHUNK_SIZE = 64 * 1024
+
+# Amount of trailing bytes kept between chunks when searching a response, so matches spanning
+# two chunks aren't missed. Bounds the length of the matches that can be found.
+SEARCH_OVERLAP = 256
+
+# Amount of downloaded data to accumulate before handing it over to be written to disk.
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Amount of accumulated blocks that can wait to be written while the download goes on.
+WRITE_QUEUE_SIZE = 2
+
+# Ways of writing downloads to disk: worker threads or kernel asynchronous I/O through caio.
+# caio is opt-in since on buffered files Linux performs it's writes synchronously when they are
+# submitted, which happens from the event loop.
+IO_BACKENDS = ('thread', 'caio')
+DEFAULT_IO_BACKEND = 'thread'
+
+
+def _get_io_backend() -> str:
+    """
+    Get the disk write backend set by the `VSCOD_IO_BACKEND` environment variable.
+
+    :return: The set backend, `DEFAULT_IO_BACKEND` if it's unset, unknown or not installed.
+    :rtype: str
+    """
+    backend = os.environ.get('VSCOD_IO_BACKEND')
+    if backend is None:
+        return DEFAULT_IO_BACKEND
+    if backend not in IO_BACKENDS:
+        logger.warning(
+            'Invalid VSCOD_IO_BACKEND {!r} (expected one of {}), using {!r} instead.',
+            backend,
+            ', '.join(IO_BACKENDS),
+            DEFAULT_IO_BACKEND,
+        )
+        return DEFAULT_IO_BACKEND
+    if backend == 'caio' and caio is None:
+        logger.warning(
+            'VSCOD_IO_BACKEND is {!r} but caio isn\'t installed, using {!r} instead.',
+            backend,
+            DEFAULT_IO_BACKEND,
+        )
+        return DEFAULT_IO_BACKEND
+    return backend
+
+
+# How downloads are written to disk, one of `IO_BACKENDS`.
+IO_BACKEND = _get_io_backend()
+
 
 def configure_verbosity(log_level: str = 'INFO', *, quiet: bool = False):
     """
     Configure the default logger's verbosity.
+    Records are enqueued and written by loguru's own worker thread, so the event loop never waits
+    on the terminal.
 
     :param log_level: The minimum log level, defaults to 'INFO'
     :type log_level: str, optional
     :param quiet: Overrides the log level and turns off the logger, defaults to False
     :type quiet: bool, optional
     """
-    logger.configure(handlers=[dict(sink=sys.stderr, level=log_level)] if not quiet else [])
+    logger.configure(
+        handlers=[dict(sink=sys.stderr, level=log_level, enqueue=True)] if not quiet else []
+    )
+
+
+@functools.lru_cache(maxsize=16)
+def _load_json_file(json_path: Path, mtime_ns: int, size: int) -> typing.Any:
+    """
+    Load the given json file, cached by it's modification time and size as well as it's path.
+
+    :param json_path: Path to the json file.
+    :type json_path: Path
+    :param mtime_ns: The file's modification time, only used as part of the cache key.
+    :type mtime_ns: int
+    :param size: The file's size, only used as part of the cache key.
+    :type size: int
+    :return: The loaded json data.
+    :rtype: typing.Any
+    """
+    data = json_path.read_bytes()
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def load_json_file(json_path: Path) -> typing.Any:
+    """
+    Load the given json file, using orjson when it's installed.
+    Loading an unchanged file again returns the same data without parsing it again,
+    so the returned data should be treated as read only.
+
+    :param json_path: Path to the json file.
+    :type json_path: Path
+    :return: The loaded json data.
+    :rtype: typing.Any
+    """
+    stat = json_path.stat()
+    return _load_json_file(json_path.resolve(), stat.st_mtime_ns, stat.st_size)
+
+
+def configure_concurrency(limit: int) -> None:
+    """
+    Configure how many requests are made at once, both per host and per batch of downloads.
+    Only affects the sessions created and the batches started afterwards.
+
+    :param limit: The maximum amount of concurrent requests, at least 1.
+    :type limit: int
+    :raises ValueError: The limit is less than 1.
+    """
+    global CONCURRENCY_LIMIT
+    if limit < 1:
+        raise ValueError(f'The concurrency limit must be at least 1, got {limit}')
+    CONCURRENCY_LIMIT = limit
+
+
+def _create_resolver() -> aiohttp.abc.AbstractResolver:
+    """
+    Create the resolver for a new session's hostnames.
+    aiodns is used when it's available, except on Proactor loops (the Windows default) which it
+    doesn't support, otherwise hostnames are resolved by the system in a thread pool.
+
+    :return: A new resolver object.
+    :rtype: aiohttp.abc.AbstractResolver
+    """
+    proactor_loop = getattr(asyncio, 'ProactorEventLoop', None)
+    if aiodns is None or (
+        proactor_loop is not None and isinstance(asyncio.get_event_loop(), proactor_loop)
+    ):
+        return aiohttp.ThreadedResolver()
+    return aiohttp.AsyncResolver()
+
+
+def create_session() -> aiohttp.ClientSession:
+    """
+    Create a session tuned for talking to the marketplace and the VSCode update servers.
+    Meant to be shared by a whole run so all of its requests reuse the same pooled connections.
+
+    :return: A new aiohttp session object.
+    :rtype: aiohttp.ClientSession
+    """
+    connector = aiohttp.TCPConnector(
+        limit=64,
+        limit_per_host=CONCURRENCY_LIMIT,
+        resolver=_create_resolver(),
+        ttl_dns_cache=DNS_CACHE_TTL,
+        use_dns_cache=True,
+        keepalive_timeout=75,
+    )
+    # No total timeout since big binaries can take a while, only a stalled connection should fail.
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=60)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+async def gather_bounded(
+    *aws: typing.Awaitable, limit: typing.Optional[int] = None
+) -> typing.List[typing.Any]:
+    """
+    Like `asyncio.gather`, but never lets more than `limit` of the awaitables run at once.
+    If any of them fails (or the gather itself is cancelled) the rest are cancelled and waited
+    for before the error propagates, so their connections and files are released right away.
+
+    :param aws: The awaitables to run.
+    :type aws: typing.Awaitable
+    :param limit: Maximum amount of awaitables to run concurrently, defaults to None
+        (CONCURRENCY_LIMIT)
+    :type limit: typing.Optional[int], optional
+    :return: The results of the awaitables, in the order they were given.
+    :rtype: typing.List[typing.Any]
+    """
+    if limit is None:
+        limit = CONCURRENCY_LIMIT
+    semaphore = asyncio.Semaphore(limit)
+    failed = False
+
+    async def _bounded(aw: typing.Awaitable) -> typing.Any:
+        nonlocal failed
+        async with semaphore:
+            if failed:  # Don't start in the slot of one that failed before the rest are cancelled.
+                raise asyncio.CancelledError
+            try:
+                return await aw
+            except BaseException:
+                failed = True
+                raise
+
+    tasks = [asyncio.ensure_future(_bounded(aw)) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for aw in aws:
+            if asyncio.iscoroutine(aw):
+                aw.close()  # Those still waiting for the semaphore never got to start.
+        raise
+
+
+async def run_in_thread(func: typing.Callable, *args: typing.Any) -> typing.Any:
+    """
+    Run a blocking function in the event loop's default executor so it won't block the loop.
+
+    :param func: The blocking function to run.
+    :type func: typing.Callable
+    :param args: Positional arguments to call the function with.
+    :type args: typing.Any
+    :return: Whatever the function returned.
+    :rtype: typing.Any
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args))
+
+
+# Flags used to open files for writing downloads into.
+_WRITE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+
+# Maximum amount of buffers handed to a single `os.writev` call, well under any IOV_MAX.
+_WRITEV_MAX_BUFFERS = 64
+
+
+def _write_chunks(fd: int, chunks: typing.List[bytes]) -> None:
+    """
+    Write all the given chunks to a file descriptor.
+    Where supported they're written together through `os.writev` instead of being joined first.
+
+    :param fd: The file descriptor to write to.
+    :type fd: int
+    :param chunks: The chunks to write, in order.
+    :type chunks: typing.List[bytes]
+    """
+    if not hasattr(os, 'writev'):  # Windows.
+        chunks = [b''.join(chunks)]
+    views = [memoryview(chunk) for chunk in chunks]
+    while views:
+        batch = views[:_WRITEV_MAX_BUFFERS]
+        written = os.writev(fd, batch) if hasattr(os, 'writev') else os.write(fd, batch[0])
+        # Drop whatever was fully written and keep the rest of a partially written view.
+        while views and written >= len(views[0]):
+            written -= len(views.pop(0))
+        if written:
+            views[0] = views[0][written:]
+
+
+def _open_for_writing(path: Path, offset: int) -> int:
+    """
+    Open a file for writing from the given offset, dropping anything at or after it.
+
+    :param path: The path of the file to write.
+    :type path: Path
+    :param offset: Where to start writing from, 0 truncates the whole file.
+    :type offset: int
+    :return: The opened file descriptor.
+    :rtype: int
+    """
+    if not offset:
+        return os.open(path, _WRITE_FLAGS, 0o666)
+    fd = os.open(path, _WRITE_FLAGS & ~os.O_TRUNC, 0o666)
+    try:
+        os.ftruncate(fd, offset)
+        os.lseek(fd, offset, os.SEEK_SET)
+    except OSError:
+        os.close(fd)
+        raise
+    return fd
+
+
+class _ThreadFileWriter:
+    """
+    Writes a file from the event loop's default executor.
+    A write that was started always runs to completion, even if the coroutine awaiting it is
+    cancelled, and closing waits for it so the file descriptor is never closed under it.
+    """
+
+    def __init__(self, fd: int) -> None:
+        self._fd = fd
+        self._pending: typing.Optional[asyncio.Future] = None
+
+    @classmethod
+    async def open(cls, path: Path, offset: int = 0) -> '_ThreadFileWriter':
+        """
+        Open a file for writing from a worker thread.
+
+        :param path: The path of the file to write.
+        :type path: Path
+        :param offset: Where to start writing from, anything after it is dropped, defaults to 0
+        :type offset: int, optional
+        :return: A writer of the opened file.
+        :rtype: _ThreadFileWriter
+        """
+        return cls(await run_in_thread(_open_for_writing, path, offset))
+
+    async def write(self, chunks: typing.List[bytes]) -> None:
+        """
+        Write chunks at the end of the file from a worker thread.
+
+        :param chunks: The chunks to write, in order.
+        :type chunks: typing.List[bytes]
+        """
+        self._pending = asyncio.ensure_future(run_in_thread(_write_chunks, self._fd, chunks))
+        await asyncio.shield(self._pending)
+
+    async def close(self) -> None:
+        """
+        Close the file once it's last started write is done, even if this gets cancelled.
+        """
+        await asyncio.shield(self._close())
+
+    async def _close(self) -> None:
+        """
+        Wait for the last started write and close the file.
+        """
+        if self._pending is not None:
+            await asyncio.wait([self._pending])
+        await run_in_thread(os.close, self._fd)
+
+
+class _CaioFileWriter:
+    """
+    Writes a file through caio, submitting the writes to the kernel's asynchronous I/O interface.
+    Like `_ThreadFileWriter`, started writes are never abandoned and closing waits for them.
+    """
+
+    def __init__(self, context: 'caio.AsyncioContext', fd: int, offset: int = 0) -> None:
+        self._context = context
+        self._fd = fd
+        self._offset = offset
+        self._pending: typing.Optional[asyncio.Future] = None
+
+    @classmethod
+    async def open(cls, path: Path, offset: int = 0) -> '_CaioFileWriter':
+        """
+        Open a file for writing through a new caio context.
+
+        :param path: The path of the file to write.
+        :type path: Path
+        :param offset: Where to start writing from, anything after it is dropped, defaults to 0
+        :type offset: int, optional
+        :return: A writer of the opened file.
+        :rtype: _CaioFileWriter
+        """
+        fd = await run_in_thread(_open_for_writing, path, offset)
+        return cls(caio.AsyncioContext(), fd, offset)
+
+    async def write(self, chunks: typing.List[bytes]) -> None:
+        """
+        Write chunks at the end of the file through caio, joined into a single buffer.
+
+        :param chunks: The chunks to write, in order.
+        :type chunks: typing.List[bytes]
+        """
+        data = b''.join(chunks)
+        while data:
+            self._pending = asyncio.ensure_future(
+                self._context.write(data, self._fd, self._offset)
+            )
+            written = await asyncio.shield(self._pending)
+            self._offset += written
+            data = data[written:]
+
+    async def close(self) -> None:
+        """
+        Close the file and the caio context once the last started write is done, even if this
+        gets cancelled.
+        """
+        await asyncio.shield(self._close())
+
+    async def _close(self) -> None:
+        """
+        Wait for the last started write, then close the caio context and the file.
+        """
+        if self._pending is not None:
+            await asyncio.wait([self._pending])
+        self._context.close()
+        await run_in_thread(os.close, self._fd)
+
+
+async def _open_file_writer(
+    path: Path, offset: int = 0
+) -> typing.Union[_ThreadFileWriter, _CaioFileWriter]:
+    """
+    Open the given path for writing with the configured `IO_BACKEND`.
+
+    :param path: The path of the file to write.
+    :type path: Path
+    :param offset: Where to start writing from, anything after it is dropped, defaults to 0
+    :type offset: int, optional
+    :return: A writer object with asynchronous `write` and `close` methods.
+    :rtype: typing.Union[_ThreadFileWriter, _CaioFileWriter]
+    """
+    if IO_BACKEND == 'caio':
+        return await _CaioFileWriter.open(path, offset)
+    return await _ThreadFileWriter.open(path, offset)
+
+
+async def _stream_to_file(
+    content: aiohttp.StreamReader,
+    save_file: typing.Union[_ThreadFileWriter, _CaioFileWriter],
+) -> None:
+    """
+    Stream a response's content into a file writer.
+    The data is accumulated into blocks of `WRITE_BUFFER_SIZE` and handed to a separate writer
+    task through a bounded queue, so the next block is received while the previous is written.
+
+    :param content: The response's content stream.
+    :type content: aiohttp.StreamReader
+    :param save_file: The writer of the file to stream into.
+    :type save_file: typing.Union[_ThreadFileWriter, _CaioFileWriter]
+    """
+    queue: 'asyncio.Queue[typing.Optional[typing.List[bytes]]]' = asyncio.Queue(WRITE_QUEUE_SIZE)
+
+    async def _write_blocks() -> None:
+        while True:
+            block = await queue.get()
+            if block is None:
+                return
+            await save_file.write(block)
+
+    writer = asyncio.ensure_future(_write_blocks())
+
+    async def _hand_over(block: typing.Optional[typing.List[bytes]]) -> None:
+        put = asyncio.ensure_future(queue.put(block))
+        try:
+            await asyncio.wait((put, writer), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            put.cancel()
+        if writer.done():
+            writer.result()  # The writer only stops early when it fails, raise it's error.
+
+    try:
+        chunks = []
+        buffered_size = 0
+        # Take the received data as is, re-chunking it would only copy it once more.
+        async for chunk in content.iter_any():
+            chunks.append(chunk)
+            buffered_size += len(chunk)
+            if buffered_size >= WRITE_BUFFER_SIZE:
+                await _hand_over(chunks)
+                chunks = []
+                buffered_size = 0
+        if chunks:
+            await _hand_over(chunks)
+        await _hand_over(None)
+        await writer
+    finally:
+        if not writer.done():
+            # Stops feeding the file, a write that already started still completes before the
+            # writer lets it be closed.
+            writer.cancel()
+            await asyncio.gather(writer, return_exceptions=True)
+
+
+def _get_retry_after(error: aiohttp.ClientResponseError) -> typing.Optional[float]:
+    """
+    Get how many seconds the server asked to wait before retrying through `Retry-After`.
+
+    :param error: The error raised for the failed response.
+    :type error: aiohttp.ClientResponseError
+    :return: Seconds to wait, None if the server didn't say.
+    :rtype: typing.Optional[float]
+    """
+    retry_after = error.headers.get('Retry-After') if error.headers else None
+    if not retry_after:
+        return None
+    if retry_after.isdigit():
+        return float(retry_after)
+    try:
+        retry_date = email.utils.parsedate_to_datetime(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_date.timestamp() - time.time(), 0)
+
+
+async def retry(
+    request: typing.Callable[[], typing.Awaitable[T]], *, attempts: int = RETRY_ATTEMPTS
+) -> T:
+    """
+    Make a request, retrying it with an exponential backoff on transient failures:
+    Connection errors, timeouts and responses with a status in `RETRY_STATUSES`.
+    When the server sends a `Retry-After` header, it's honored instead of the backoff, up to
+    `RETRY_MAX_DELAY` so a misbehaving server can't stall the whole run.
+
+    :param request: Function making the request, it should raise for bad response statuses.
+    :type request: typing.Callable[[], typing.Awaitable[T]]
+    :param attempts: How many times to attempt the request, defaults to RETRY_ATTEMPTS
+    :type attempts: int, optional
+    :return: Whatever the request returned.
+    :rtype: T
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return await request()
+        except aiohttp.ClientResponseError as error:
+            if error.status not in RETRY_STATUSES or attempt == attempts:
+                raise
+            delay = _get_retry_after(error)
+            if delay is not None:
+                delay = min(delay, RETRY_MAX_DELAY)
+            failure = error
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            if attempt == attempts:
+                raise
+            delay = None
+            failure = error
+        if delay is None:
+            delay = min(2 ** attempt, RETRY_MAX_DELAY) + random.random()
+        logger.debug('Attempt {} failed ({!r}), retrying in {:.1f}s...', attempt, failure, delay)
+        await asyncio.sleep(delay)
+
+
+def _make_directories(directories: typing.Iterable[Path]) -> None:
+    """
+    Create the given directories along with any missing parents.
+
+    :param directories: The directories to create.
+    :type directories: typing.Iterable[Path]
+    """
+    for directory in directories:
+        directory.mkdir(parents=True, exist_ok=True)
+
+
+async def make_directories(directories: typing.Iterable[Path]) -> None:
+    """
+    Create the given directories along with any missing parents from a worker thread.
+    Each distinct directory is only created once.
+
+    :param directories: The directories to create.
+    :type directories: typing.Iterable[Path]
+    :return: None.
+    :rtype: None
+    """
+    await run_in_thread(_make_directories, list(dict.fromkeys(directories)))
+
+
+def _get_response_filename(response: aiohttp.ClientResponse) -> str:
+    """
+    Get the filename a response is served as.
+    This uses either the `Content-Disposition` header if exists and fallbacks on the url.
+
+    :param response: The response to get the filename of.
+    :type response: aiohttp.ClientResponse
+    :return: The response's filename.
+    :rtype: str
+    """
+    content_disposition = response.content_disposition
+    if content_disposition and content_disposition.filename:
+        return Path(content_disposition.filename).name  # Never let the server pick a directory.
+    return response.url.name
 
 
 async def get_original_filename(session: aiohttp.ClientSession, url: str) -> str:
     """
     Get the original filename of a desired download link.
-    This uses either the `Content-Disposition` header if exists and fallbacks on the url.
+    Only the headers are requested so the actual file isn't transferred,
+    if the server doesn't allow that only the file's first byte is requested.
 
     :param session: The session through which to make the request.
     :type session: aiohttp.ClientSession
@@ -32,36 +650,83 @@ async def get_original_filename(session: aiohttp.ClientSession, url: str) -> str
     :return: The original url filename.
     :rtype: str
     """
-    async with session.get(url) as response:
-        content_disposition = response.headers.get('Content-Disposition')
-        if content_disposition:
-            name = re.findall('filename=(.+);', content_disposition)[0]
-        else:
-            name = Path(str(response.url)).name
-        logger.debug(f'{url} file name is {name}.')
-        return name
 
+    async def _get_name() -> str:
+        async with session.head(url, allow_redirects=True) as response:
+            if response.status != HTTPStatus.METHOD_NOT_ALLOWED:
+                response.raise_for_status()
+                return _get_response_filename(response)
+        async with session.get(url, headers={'Range': 'bytes=0-0'}) as response:
+            response.raise_for_status()
+            return _get_response_filename(response)
+
+    name = await retry(_get_name)
+    logger.debug('{} file name is {}.', url, name)
+    return name
 
-async def get_request(
-    session: aiohttp.ClientSession, url: str, *, return_type: typing.Type = bytes
-) -> typing.AnyStr:
+
+async def search_url(
+    session: aiohttp.ClientSession, url: str, pattern: typing.Pattern[bytes]
+) -> typing.Optional[typing.Match[bytes]]:
     """
-    Make an asynchronous get request.
+    Search a url's raw data for a pattern as it's streamed, without decoding it.
+    The request stops as soon as a match is found so the rest of the data isn't downloaded.
 
     :param session: The session through which to make the request.
     :type session: aiohttp.ClientSession
-    :param url: The desired url to get.
+    :param url: The desired url to search.
     :type url: str
-    :param return_type: What type should the returned data be in, defaults to bytes
-    :type return_type: typing.Type, optional
-    :return: The url's data in the desired type.
-    :rtype: typing.AnyStr
+    :param pattern: The compiled bytes pattern to search for, matches can't be longer than
+        `SEARCH_OVERLAP`.
+    :type pattern: typing.Pattern[bytes]
+    :raises aiohttp.ClientError: The request failed even after retrying.
+    :return: The first match found, None if there's none.
+    :rtype: typing.Optional[typing.Match[bytes]]
+    """
+
+    async def _search() -> typing.Optional[typing.Match[bytes]]:
+        async with session.get(url) as response:
+            response.raise_for_status()
+            tail = b''
+            async for chunk in response.content.iter_chunked(SEARCH_CHUNK_SIZE):
+                data = tail + chunk
+                match = pattern.search(data)
+                if match:
+                    logger.debug('Found a match in {}', url)
+                    return match
+                tail = data[-SEARCH_OVERLAP:]
+            return None
+
+    return await retry(_search)
+
+
+def _get_partial_path(directory: Path, url: str) -> Path:
     """
-    async with session.get(url) as response:
-        logger.debug(f'Got answer from {url}')
-        if return_type is str:
-            return await response.text()
-        return await response.read()
+    Get where a url is downloaded to until it's complete, a hidden file named after the url.
+
+    :param directory: The directory the url is downloaded into.
+    :type directory: Path
+    :param url: The downloaded url.
+    :type url: str
+    :return: The path of the url's partial download.
+    :rtype: Path
+    """
+    return directory / f'.{hashlib.sha1(url.encode()).hexdigest()[:16]}.part'
+
+
+def _get_file_size(path: Path) -> int:
+    """
+    Get a file's size, 0 if it doesn't exist.
+
+    :param path: The path of the file.
+    :type path: Path
+    :return: The file's size in bytes.
+    :rtype: int
+    """
+    try:
+        return path.stat().st_size
+    except FileNotFoundError:
+        return 0
 
 
 async def download_url(
@@ -69,24 +734,90 @@ async def download_url(
     url: str,
     save_path: Path,
     *,
-    return_type: typing.Type = bytes,
-) -> None:
+    manifest: typing.Optional['DownloadManifest'] = None,
+) -> Path:
     """
     Get a url's data and download it to a file.
+    If the save path is an existing directory, the file is saved inside it under it's original
+    name, taken from the download's own response so no extra request is needed to find it.
+    The data is streamed chunk by chunk and written in large blocks through the `IO_BACKEND`,
+    so neither the whole file is held in memory nor the event loop blocks on disk writes.
+    It's written to a hidden `.part` file first, so an interrupted download is resumed from where
+    it stopped (by a retry, or by a later run with a manifest) if the file didn't change since.
+    With a manifest, a url that was already downloaded to the same place is requested
+    conditionally and isn't downloaded again if the server says it hasn't changed.
 
     :param session: The session through which to make the request.
     :type session: aiohttp.ClientSession
     :param url: The desired url to download.
     :type url: str
-    :param save_path: Where to save the downloaded data.
+    :param save_path: Where to save the downloaded data, either a file or a directory.
     :type save_path: Path
-    :param return_type: What type should the returned data be in, defaults to bytes
-    :type return_type: typing.Type, optional
-    :return: None.
-    :rtype: None
+    :param manifest: The manifest of the directory being downloaded into, defaults to None
+    :type manifest: typing.Optional[DownloadManifest], optional
+    :return: The path of the downloaded file.
+    :rtype: Path
     """
-    logger.debug(f'Downloading {url}...')
-    data: bytes = await get_request(session, url, return_type=return_type)
-    async with aiofiles.open(save_path, 'wb') as save_file:
-        await save_file.write(data)
-    logger.info(f'Downloaded {url} to {url}.')
+    logger.debug('Downloading {}...', url)
+    save_path = Path(save_path)  # Plain string paths are accepted as well.
+    previous_download = manifest.get(url, save_path) if manifest is not None else None
+    resume_validator = manifest.get_partial(url, save_path) if manifest is not None else None
+
+    def _inspect_targets() -> typing.Tuple[bool, bool]:
+        is_directory = save_path.is_dir()
+        if previous_download is None:
+            return is_directory, False
+        previous_path = previous_download[0]
+        expected_path = previous_path.parent if is_directory else previous_path
+        return is_directory, expected_path == save_path and previous_path.is_file()
+
+    save_to_directory, can_skip = await run_in_thread(_inspect_targets)
+    partial_path = _get_partial_path(save_path if save_to_directory else save_path.parent, url)
+
+    async def _download() -> typing.Tuple[Path, bool]:
+        nonlocal resume_validator
+        offset = await run_in_thread(_get_file_size, partial_path) if resume_validator else 0
+        # The downloaded files are archives already, compressing them again only wastes CPU.
+        headers = {'Accept-Encoding': 'identity'}
+        if offset:
+            headers.update({'Range': f'bytes={offset}-', 'If-Range': resume_validator})
+        elif can_skip:
+            headers.update(previous_download[1])
+        async with session.get(url, headers=headers) as response:
+            if response.status == HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE:
+                resume_validator = None
+                raise aiohttp.ClientPayloadError(f'Can\'t resume the download of {url}')
+            response.raise_for_status()
+            if response.status == HTTPStatus.NOT_MODIFIED:
+                return previous_download[0], False
+            if response.status != HTTPStatus.PARTIAL_CONTENT:
+                offset = 0  # The file changed (or ranges aren't supported), start over.
+            elif offset:
+                logger.debug('Resuming {} from byte {}', url, offset)
+            etag = response.headers.get('ETag', '')
+            if etag and not etag.startswith('W/'):  # `If-Range` only accepts strong validators.
+                resume_validator = etag
+            else:
+                resume_validator = response.headers.get('Last-Modified')
+            if manifest is not None:
+                manifest.set(url, save_path, partial_path, response.headers, partial=True)
+            if save_to_directory:
+                file_path = save_path / _get_response_filename(response)
+            else:
+                file_path = save_path
+            save_file = await _open_file_writer(partial_path, offset)
+            try:
+                await _stream_to_file(response.content, save_file)
+            finally:
+                await save_file.close()
+            await run_in_thread(os.replace, partial_path, file_path)
+            if manifest is not None:
+                manifest.set(url, save_path, file_path, response.headers)
+        return file_path, True
+
+    file_path, downloaded = await retry(_download)
+    if downloaded:
+        logger.info('Downloaded {} to {}.', url, file_path)
+    else:
+        logger.info('{} is unchanged, skipped downloading it.', file_path)
+    return file_path
@@ -1,25 +1,36 @@
-import asyncio
 import dataclasses
 import typing
-import json
 from pathlib import Path
 
 import aiohttp
 from loguru import logger
 
-from .utils import download_url, get_original_filename
+from .cache import DownloadManifest
+from .utils import (
+    DATACLASS_SLOTS,
+    create_session,
+    download_url,
+    gather_bounded,
+    load_json_file,
+    make_directories,
+    run_in_thread,
+)
+
+# Link to the VSCode update server.
+UPDATE_SERVER_LINK = 'https://update.code.visualstudio.com'
 
 # Format string linking to the download of a VSCode binary.
-DOWNLOAD_CODE_LINK = 'https://update.code.visualstudio.com/{version}/{platform}/{build}'
+DOWNLOAD_CODE_LINK = UPDATE_SERVER_LINK + '/{version}/{platform}/{build}'
 
 # The token for when you want to get the absolute latest version.
 LATEST_VERSION = 'latest'
 
 
-@dataclasses.dataclass
+@dataclasses.dataclass(frozen=True, **DATACLASS_SLOTS)
 class VSCodeSpec:
     """
     Dataclass for storing info regarding a certain VSCode binary.
+    Immutable and hashable, so identical specs can be told apart from distinct ones.
     """
 
     platform: str  # Desired installation platform specific string.
@@ -56,11 +67,17 @@ class _Builds:
 PLATFORMS = _Platforms()  # Platforms singleton.
 BUILDS = _Builds()  # Builds singleton
 
+# The tokens' names mapped to the tokens themselves, and the valid tokens, computed once.
+PLATFORM_OPTIONS = {k: v for k, v in vars(_Platforms).items() if not k.startswith('__')}
+BUILD_OPTIONS = {k: v for k, v in vars(_Builds).items() if not k.startswith('__')}
+PLATFORM_CHOICES = tuple(PLATFORM_OPTIONS.values())
+BUILD_CHOICES = tuple(BUILD_OPTIONS.values())
+
 
 def _build_vscode_download_url(platform: str, build: str, version: str) -> str:
     """
     Build the download url for the given parameters.
-    Just a shortcut for the string formatting.
+    Same as formatting `DOWNLOAD_CODE_LINK`, without parsing the template on every call.
 
     :param platform: Desired platform.
     :type platform: str
@@ -71,7 +88,7 @@ def _build_vscode_download_url(platform: str, build: str, version: str) -> str:
     :return: The formatted download url.
     :rtype: str
     """
-    return DOWNLOAD_CODE_LINK.format(platform=platform, build=build, version=version)
+    return f'{UPDATE_SERVER_LINK}/{version}/{platform}/{build}'
 
 
 def _build_vscode_download_url_from_spec(spec: VSCodeSpec) -> str:
@@ -95,7 +112,8 @@ async def download_vscode(
     *,
     build: str = BUILDS.STABLE,
     version: str = LATEST_VERSION,
-) -> None:
+    manifest: typing.Optional[DownloadManifest] = None,
+) -> Path:
     """
     Download a VSCode binary according to the passed parameters into the given save path.
 
@@ -103,24 +121,32 @@ async def download_vscode(
     :type session: aiohttp.ClientSession
     :param platform: Desired VSCode platform.
     :type platform: str
-    :param save_path: Save path for the downloaded binary.
+    :param save_path: Save path for the downloaded binary, if it's an existing directory the
+        binary is saved inside it under it's original name.
     :type save_path: Path
     :param build: Desired VSCode build, defaults to BUILDS.STABLE
     :type build: str, optional
     :param version: Desired VSCode version, defaults to LATEST_VERSION
     :type version: str, optional
-    :return: None.
-    :rtype: None
+    :param manifest: The manifest of the directory being downloaded into, defaults to None
+    :type manifest: typing.Optional[DownloadManifest], optional
+    :return: The path of the downloaded binary.
+    :rtype: Path
     """
-    logger.info(f'Downloading {platform} version...')
+    logger.info('Downloading {} version...', platform)
     url = _build_vscode_download_url(platform, build, version)
-    await download_url(session, url, save_path, return_type=bytes)
-    logger.info(f'Downloaded {version}/{platform}/{build} version to {save_path}.')
+    binary_path = await download_url(session, url, save_path, manifest=manifest)
+    logger.info('Downloaded {}/{}/{} version to {}.', version, platform, build, binary_path)
+    return binary_path
 
 
 async def download_vscode_from_spec(
-    session: aiohttp.ClientSession, spec: VSCodeSpec, save_path: Path
-) -> None:
+    session: aiohttp.ClientSession,
+    spec: VSCodeSpec,
+    save_path: Path,
+    *,
+    manifest: typing.Optional[DownloadManifest] = None,
+) -> Path:
     """
     Download a VSCode binary according to the passed parameters into the given save path.
 
@@ -128,10 +154,13 @@ async def download_vscode_from_spec(
     :type session: aiohttp.ClientSession
     :param spec: A spec object containing all the relevant information to download a VSCode binary.
     :type spec: VSCodeSpec
-    :param save_path: Save path for the downloaded binary.
+    :param save_path: Save path for the downloaded binary, if it's an existing directory the
+        binary is saved inside it under it's original name.
     :type save_path: Path
-    :return: None.
-    :rtype: None
+    :param manifest: The manifest of the directory being downloaded into, defaults to None
+    :type manifest: typing.Optional[DownloadManifest], optional
+    :return: The path of the downloaded binary.
+    :rtype: Path
     """
     return await download_vscode(
         session=session,
@@ -139,6 +168,7 @@ async def download_vscode_from_spec(
         platform=spec.platform,
         build=spec.build,
         version=spec.version,
+        manifest=manifest,
     )
 
 
@@ -147,6 +177,7 @@ def _parse_vscode_specification_dict(
 ) -> typing.List[VSCodeSpec]:
     """
     Parse the given specification list into a list of spec objects.
+    Repeated specs are only kept once (in their first position), so they're downloaded once.
 
     :param specification: A list of dicts containing various attributes that describe a VSCode binary.
     :type specification: typing.Dict[str, str]
@@ -154,14 +185,15 @@ def _parse_vscode_specification_dict(
     :rtype: typing.List[VSCodeSpec]
     """
     logger.debug(specification)
-    return [
+    specs = (
         VSCodeSpec(
             platform=spec['platform'],
             build=spec.get('build', BUILDS.STABLE),
             version=spec.get('version', LATEST_VERSION),
         )
         for spec in specification
-    ]
+    )
+    return list(dict.fromkeys(specs))
 
 
 def parse_vscode_json(
@@ -170,7 +202,8 @@ def parse_vscode_json(
     """
     Decide wether the data provided was a Path or not and act accordingly:
     If it's valid json format data, parse it and return a list of specs.
-    If it's a Path, open it and then do the same thing.
+    If it's a Path, open it and then do the same thing, a config without a "vscode" section
+    has no VSCode binaries to download.
 
     :param json_data: Either a path to a json config file or it's raw data (dict / list).
     :type json_data: typing.Union[typing.List[typing.Dict[str, str]], Path]
@@ -178,15 +211,17 @@ def parse_vscode_json(
     :rtype: typing.List[VSCodeSpec]
     """
     if isinstance(json_data, Path):
-        with json_data.open() as json_file:
-            json_data = json.load(json_file)['vscode']
+        json_data = load_json_file(json_data).get('vscode', [])
     if not isinstance(json_data, list):
         json_data = [json_data]
     return _parse_vscode_specification_dict(json_data)
 
 
 async def download_vscode_json(
-    json_data: typing.Union[typing.List[typing.Dict[str, str]], Path], save_path: Path
+    json_data: typing.Union[typing.List[typing.Dict[str, str]], Path],
+    save_path: Path,
+    *,
+    session: typing.Optional[aiohttp.ClientSession] = None,
 ) -> None:
     """
     Parse the given json data and download the given VSCode instances into the save path.
@@ -195,21 +230,24 @@ async def download_vscode_json(
     :type json_data: typing.Union[typing.List[typing.Dict[str, str]], Path]
     :param save_path: Save path for all the downloaded VSCode binaries.
     :type save_path: Path
+    :param session: An aiohttp session object to use, defaults to None (create a new one)
+    :type session: typing.Optional[aiohttp.ClientSession], optional
     :return: None.
     :rtype: None
     """
+    if session is None:
+        async with create_session() as session:
+            return await download_vscode_json(json_data, save_path, session=session)
     vscode_specs = parse_vscode_json(json_data)
-    async with aiohttp.ClientSession() as session:
-        get_vscode_filename_tasks = [
-            get_original_filename(session, _build_vscode_download_url_from_spec(spec))
-            for spec in vscode_specs
-        ]
-        vscode_filenames = await asyncio.gather(*get_vscode_filename_tasks)
-        download_vscode_tasks = []
-        for spec, filename in zip(vscode_specs, vscode_filenames):
-            vscode_full_save_path = save_path / spec.platform / filename
-            vscode_full_save_path.parent.mkdir(parents=True, exist_ok=True)
-            download_vscode_tasks.append(
-                download_vscode_from_spec(session, spec, vscode_full_save_path)
-            )
-        await asyncio.gather(*download_vscode_tasks)
+    vscode_save_directories = [save_path / spec.platform for spec in vscode_specs]
+    await make_directories(vscode_save_directories)
+    manifest = DownloadManifest(save_path)
+    await run_in_thread(manifest.load)
+    download_vscode_tasks = [
+        download_vscode_from_spec(session, spec, vscode_save_directory, manifest=manifest)
+        for spec, vscode_save_directory in zip(vscode_specs, vscode_save_directories)
+    ]
+    try:
+        await gather_bounded(*download_vscode_tasks)
+    finally:
+        await run_in_thread(manifest.save)